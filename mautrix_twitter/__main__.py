@@ -25,7 +25,7 @@ from mautrix.util import background_task
 from . import commands
 from .backfill import BackfillStatus
 from .config import Config
-from .db import init as init_db, upgrade_table
+from .db import Message as DBMessage, init as init_db, upgrade_table
 from .matrix import MatrixHandler
 from .portal import Portal
 from .puppet import Puppet
@@ -68,13 +68,30 @@ class TwitterBridge(Bridge):
         Portal.init_cls(self)
         if self.config["bridge.resend_bridge_info"]:
             self.add_startup_actions(self.resend_bridge_info())
-        background_task.create(BackfillStatus.backfill_loop())
+        background_task.create(
+            BackfillStatus.backfill_loop(
+                workers=self.config["bridge.backfill.workers"],
+                max_per_user=self.config["bridge.backfill.max_per_user"],
+                lease_duration=self.config["bridge.backfill.lease_duration"],
+                portal_interval=self.config["bridge.backfill.portal_interval"],
+            )
+        )
+        if self.config["bridge.media_cache.enabled"]:
+            background_task.create(Portal.expire_media_cache_loop())
         await super().start()
 
     def prepare_stop(self) -> None:
         self.add_shutdown_actions(user.stop() for user in User.by_twid.values())
         for puppet in Puppet.by_custom_mxid.values():
             puppet.stop()
+        self.add_shutdown_actions(Puppet.close_avatar_http())
+
+    async def stop_db(self) -> None:
+        # The users are stopped by now, so write any messages that are still buffered before
+        # the database is closed.
+        if DBMessage.write_buffer:
+            await DBMessage.write_buffer.flush()
+        await super().stop_db()
 
     async def resend_bridge_info(self) -> None:
         self.config["bridge.resend_bridge_info"] = False
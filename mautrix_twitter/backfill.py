@@ -17,7 +17,9 @@ from __future__ import annotations
 
 import asyncio
 import logging
-import traceback
+import socket
+import time
+import uuid
 
 # from .config import Config
 from .db import BackfillStatus as DBBackfillStatus
@@ -33,39 +35,116 @@ log = logging.getLogger("mau.backfill_loop")
 
 
 class BackfillStatus(DBBackfillStatus):
-    recheck_queues: set[asyncio.Queue] = set()
+    recheck_event: asyncio.Event | None = None
+    # Number of backfills currently running for each backfill user
+    active_per_user: dict[int, int] = {}
+    max_per_user: int = 1
+    _claim_lock: asyncio.Lock | None = None
+    # Unique ID of this process, used as the prefix of backfill lease tokens
+    worker_owner: str = f"{socket.gethostname()}/{uuid.uuid4().hex[:12]}"
+    # How long a lease is valid for without being renewed, in milliseconds
+    lease_duration: int = 5 * 60 * 1000
+    # Minimum time between two backfill jobs of the same portal, in milliseconds
+    portal_interval: int = 10 * 1000
 
     @classmethod
     async def recheck(cls) -> None:
-        for q in cls.recheck_queues:
-            await q.put(True)
+        if cls.recheck_event is not None:
+            cls.recheck_event.set()
 
     @classmethod
-    async def get_next_backfill_status(cls, recheck_queue: asyncio.Queue) -> BackfillStatus:
+    async def claim_next_backfill_status(cls) -> BackfillStatus:
         while True:
-            status = await cls.get_next_unfinished_status()
-            if status != None:
-                return status
+            # Clear before claiming, so a recheck that happens while claiming isn't lost
+            cls.recheck_event.clear()
+            # Claims are serialized within this process so that the per-user counts
+            # can't be exceeded by workers claiming concurrently.
+            async with cls._claim_lock:
+                busy = [
+                    user
+                    for user, count in cls.active_per_user.items()
+                    if count >= cls.max_per_user
+                ]
+                # Every claim gets its own token, so that a stalled worker can't write its
+                # result after another worker in the same process took over the lease.
+                status = await cls.claim_next(
+                    owner=f"{cls.worker_owner}/{uuid.uuid4().hex}",
+                    duration=cls.lease_duration,
+                    exclude_users=busy,
+                )
+                if status is not None:
+                    user = status.backfill_user
+                    cls.active_per_user[user] = cls.active_per_user.get(user, 0) + 1
+                    return status
 
             try:
-                await asyncio.wait_for(recheck_queue.get(), 10)
-            except asyncio.exceptions.TimeoutError:
+                await asyncio.wait_for(cls.recheck_event.wait(), 10)
+            except asyncio.TimeoutError:
                 pass
 
     @classmethod
-    async def backfill_loop(cls) -> None:
-        recheck_queue = asyncio.Queue()
-        cls.recheck_queues.add(recheck_queue)
+    def _release(cls, state: BackfillStatus) -> None:
+        count = cls.active_per_user.get(state.backfill_user, 0) - 1
+        if count > 0:
+            cls.active_per_user[state.backfill_user] = count
+        else:
+            cls.active_per_user.pop(state.backfill_user, None)
+        # Other portals of the same user may have been skipped while this one was running
+        cls.recheck_event.set()
 
+    @classmethod
+    async def backfill_loop(
+        cls,
+        workers: int = 1,
+        max_per_user: int = 1,
+        lease_duration: int = 300,
+        portal_interval: float = 10,
+    ) -> None:
+        cls.max_per_user = max(max_per_user, 1)
+        cls.lease_duration = lease_duration * 1000
+        cls.portal_interval = int(portal_interval * 1000)
+        cls.recheck_event = asyncio.Event()
+        cls._claim_lock = asyncio.Lock()
+        reclaimed = await cls.reclaim_expired_leases()
+        if reclaimed:
+            log.info(f"Reclaimed {reclaimed} backfills with expired leases")
+        log.debug(f"Starting {workers} backfill workers (max {cls.max_per_user} per user)")
+        await asyncio.gather(*(cls.backfill_worker(i) for i in range(max(workers, 1))))
+
+    async def _heartbeat(self, job: asyncio.Task) -> bool:
+        while True:
+            await asyncio.sleep(self.lease_duration / 1000 / 3)
+            try:
+                if not await self.renew_lease(self.lease_duration):
+                    # Another worker owns the portal now, so stop sending messages right away
+                    # instead of duplicating the history it's sending.
+                    log.warning(f"Lost backfill lease of {self.twid} to another worker")
+                    job.cancel()
+                    return True
+            except Exception:
+                log.warning(f"Failed to renew backfill lease of {self.twid}", exc_info=True)
+
+    @classmethod
+    async def backfill_worker(cls, worker_id: int) -> None:
         while True:
-            await asyncio.sleep(2)
-            state = await cls.get_next_backfill_status(recheck_queue)
-            portal = await Portal.get_by_twid(twid=state.twid, receiver=state.receiver)
-            source = await User.get_by_twid(state.backfill_user)
+            state = await cls.claim_next_backfill_status()
+            log.debug(f"Worker {worker_id} backfilling {state.twid} for {state.backfill_user}")
+            heartbeat = None
             try:
-                state.dispatched = True
-                await state.update()
-                num_filled = await portal.backfill(source, is_initial=state.state == 0)
+                portal = await Portal.get_by_twid(twid=state.twid, receiver=state.receiver)
+                source = await User.get_by_twid(state.backfill_user)
+                job = asyncio.create_task(
+                    portal.backfill(source, is_initial=state.state == 0, status=state)
+                )
+                heartbeat = asyncio.create_task(state._heartbeat(job))
+                try:
+                    num_filled = await job
+                except asyncio.CancelledError:
+                    lease_lost = heartbeat.done() and not heartbeat.cancelled()
+                    if not lease_lost or not heartbeat.result():
+                        raise
+                    log.warning(f"Stopped backfilling {state.twid}: lease lost")
+                    continue
 
                 state.message_count += num_filled
                 if num_filled == 0:
@@ -79,5 +158,13 @@ class BackfillStatus(DBBackfillStatus):
                 log.exception(f"Error handling backfill task for {state.twid}")
                 state.state = 3
             finally:
-                state.dispatched = False
-                await state.update()
+                if heartbeat:
+                    heartbeat.cancel()
+                if state.state < 2:
+                    # Let other portals (and the rate limits) have a turn before the next page
+                    state.not_before = int(time.time() * 1000) + cls.portal_interval
+                try:
+                    if not await state.release():
+                        log.warning(f"Not saving backfill result of {state.twid}: lease lost")
+                finally:
+                    cls._release(state)
@@ -54,6 +54,8 @@ class Config(BaseBridgeConfig):
         copy("bridge.displayname_max_length")
 
         copy("bridge.initial_conversation_sync")
+        copy("bridge.sync_concurrency.conversations")
+        copy("bridge.sync_concurrency.puppets")
         copy("bridge.sync_with_custom_puppets")
         copy("bridge.sync_direct_chat_list")
         copy("bridge.low_quality_tag")
@@ -71,6 +73,11 @@ class Config(BaseBridgeConfig):
         copy("bridge.backfill.initial_limit")
         copy("bridge.backfill.disable_notifications")
         copy("bridge.backfill.backwards")
+        copy("bridge.backfill.workers")
+        copy("bridge.backfill.max_per_user")
+        copy("bridge.backfill.lease_duration")
+        copy("bridge.backfill.portal_interval")
+        copy("bridge.backfill.prefetch_pages")
         if isinstance(self.get("bridge.private_chat_portal_meta", "default"), bool):
             base["bridge.private_chat_portal_meta"] = (
                 "always" if self["bridge.private_chat_portal_meta"] else "default"
@@ -86,6 +93,28 @@ class Config(BaseBridgeConfig):
         copy("bridge.disable_bridge_notices")
         copy("bridge.error_sleep")
         copy("bridge.max_poll_errors")
+        copy("bridge.poll_interval.min")
+        copy("bridge.poll_interval.max")
+        copy("bridge.poll_interval.step")
+        copy("bridge.poll_interval.active_window")
+        copy("bridge.concurrent_dispatch.enabled")
+        copy("bridge.concurrent_dispatch.per_user")
+        copy("bridge.concurrent_dispatch.global")
+        copy("bridge.poll_scheduler.enabled")
+        copy("bridge.poll_scheduler.max_concurrent")
+        copy("bridge.poll_scheduler.jitter")
+        copy("bridge.poll_scheduler.spacing")
+        copy("bridge.message_write_buffer.enabled")
+        copy("bridge.message_write_buffer.max_size")
+        copy("bridge.message_write_buffer.max_delay")
+        copy("bridge.message_cache_size")
+        copy("bridge.media_cache.enabled")
+        copy("bridge.media_cache.ttl")
+        copy("bridge.media_cache.memory_size")
+        copy("bridge.media_concurrency")
+        copy("bridge.media_worker.threads")
+        copy("bridge.media_worker.max_queued")
+        copy("bridge.media_worker.ffmpeg_processes")
         copy("bridge.resend_bridge_info")
         copy("bridge.caption_in_message")
 
@@ -1,17 +1,29 @@
 from mautrix.util.async_db import Database
 
 from .backfill import BackfillStatus
+from .media_cache import MediaCache
 from .message import Message
 from .portal import Portal
 from .puppet import Puppet
 from .reaction import Reaction
 from .upgrade import upgrade_table
 from .user import User
+from .write_buffer import WriteBuffer
 
 
 def init(db: Database) -> None:
-    for table in (User, Puppet, Portal, Message, Reaction, BackfillStatus):
+    for table in (User, Puppet, Portal, Message, Reaction, BackfillStatus, MediaCache):
         table.db = db
 
 
-__all__ = ["upgrade_table", "User", "Puppet", "Portal", "Message", "Reaction", "BackfillStatus"]
+__all__ = [
+    "upgrade_table",
+    "User",
+    "Puppet",
+    "Portal",
+    "Message",
+    "Reaction",
+    "BackfillStatus",
+    "MediaCache",
+    "WriteBuffer",
+]
@@ -15,11 +15,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, ClassVar, Collection
+import time
 
 from attr import dataclass
 
-from mautrix.util.async_db import Database
+from mautrix.util.async_db import Database, Scheme
 
 fake_db = Database.create("") if TYPE_CHECKING else None
 
@@ -28,12 +29,27 @@ fake_db = Database.create("") if TYPE_CHECKING else None
 class BackfillStatus:
     db: ClassVar[Database] = fake_db
 
+    # Portals that a user has interacted with are backfilled before anything else
+    PRIORITY_NORMAL: ClassVar[int] = 0
+    PRIORITY_USER_ACTIVE: ClassVar[int] = 1
+
     twid: str
     receiver: int | None
     backfill_user: int
-    dispatched: bool
     message_count: int
     state: int
+    priority: int = PRIORITY_NORMAL
+    # Unix timestamp in milliseconds of the last activity in the portal
+    last_activity: int = 0
+    # The token of the claim that is currently backfilling the portal, and the Unix timestamp in ms
+    # after which other workers may take over if the owner hasn't renewed the lease.
+    lease_owner: str | None = None
+    lease_expires: int | None = None
+    # The Twitter message ID that history backfilling continues from
+    min_entry_id: str | None = None
+    # Unix timestamp in milliseconds before which the backfill won't be claimed again, so that
+    # a portal with a long history doesn't keep a worker to itself.
+    not_before: int = 0
 
     @property
     def _values(self):
@@ -41,39 +57,187 @@ class BackfillStatus:
             self.twid,
             self.receiver,
             self.backfill_user,
-            self.dispatched,
             self.message_count,
             self.state,
+            self.priority,
+            self.last_activity,
+            self.lease_owner,
+            self.lease_expires,
+            self.min_entry_id,
+            self.not_before,
         )
 
+    columns: ClassVar[str] = (
+        "twid, receiver, backfill_user, message_count, state, priority, last_activity, "
+        "lease_owner, lease_expires, min_entry_id, not_before"
+    )
+    # Higher priority first, then the most recently active portals. Initial backfills go before
+    # history backfills of portals with the same priority and activity.
+    queue_order: ClassVar[str] = "priority DESC, last_activity DESC, state ASC, message_count ASC"
+
     async def insert(self) -> None:
-        q = """INSERT INTO backfill_status (twid, receiver, backfill_user, dispatched, message_count, state)
-            VALUES ($1, $2, $3, $4, $5, $6)"""
+        q = f"""INSERT INTO backfill_status ({self.columns})
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)"""
         await self.db.execute(q, *self._values)
 
     async def update(self) -> None:
-        q = """UPDATE backfill_status SET backfill_user=$3, dispatched=$4, message_count=$5, state=$6
+        # The priority and activity columns are intentionally not updated here, so that a bump
+        # that happens while the portal is being backfilled isn't overwritten afterwards.
+        q = """UPDATE backfill_status
+            SET backfill_user=$3, message_count=$4, state=$5, min_entry_id=$6
             WHERE twid=$1 AND receiver=$2"""
-        await self.db.execute(q, *self._values)
+        await self.db.execute(q, *self._values[:5], self.min_entry_id)
+
+    async def save_cursor(self) -> bool:
+        """
+        Store :attr:`min_entry_id` after a page of history has been backfilled, so that the
+        backfill can continue from the same place if it's interrupted.
+
+        Returns:
+            ``True`` if the lease was still held and the cursor was stored.
+        """
+        q = """UPDATE backfill_status SET min_entry_id=$4
+            WHERE twid=$1 AND receiver=$2 AND lease_owner=$3
+            RETURNING twid"""
+        saved = await self.db.fetchval(
+            q, self.twid, self.receiver, self.lease_owner, self.min_entry_id
+        )
+        return saved is not None
+
+    async def renew_lease(self, duration: int) -> bool:
+        """
+        Extend the lease of a claimed backfill.
+
+        Args:
+            duration: The number of milliseconds the lease should be valid for from now.
+
+        Returns:
+            ``True`` if the lease is still held by :attr:`lease_owner`, ``False`` if it expired
+            and was taken over by another worker.
+        """
+        expires = int(time.time() * 1000) + duration
+        q = """UPDATE backfill_status SET lease_expires=$4
+            WHERE twid=$1 AND receiver=$2 AND lease_owner=$3
+            RETURNING twid"""
+        renewed = await self.db.fetchval(q, self.twid, self.receiver, self.lease_owner, expires)
+        if renewed is None:
+            return False
+        self.lease_expires = expires
+        return True
+
+    async def release(self) -> bool:
+        """
+        Store the result of a backfill and give up the lease. Nothing is written if the lease was
+        taken over by another worker in the meantime.
+
+        Returns:
+            ``True`` if the lease was still held and the result was stored.
+        """
+        q = """UPDATE backfill_status
+            SET backfill_user=$4, message_count=$5, state=$6, min_entry_id=$7, not_before=$8,
+                lease_owner=NULL, lease_expires=NULL
+            WHERE twid=$1 AND receiver=$2 AND lease_owner=$3
+            RETURNING twid"""
+        released = await self.db.fetchval(
+            q,
+            self.twid,
+            self.receiver,
+            self.lease_owner,
+            self.backfill_user,
+            self.message_count,
+            self.state,
+            self.min_entry_id,
+            self.not_before,
+        )
+        self.lease_owner = self.lease_expires = None
+        return released is not None
 
     @classmethod
-    async def get_by_twid(cls, twid: int, receiver: int = 0) -> BackfillStatus | None:
-        q = """SELECT twid, receiver, backfill_user, dispatched, message_count, state FROM backfill_status
-        WHERE twid =$1 AND receiver =$2"""
+    async def reclaim_expired_leases(cls) -> int:
+        """
+        Clear leases that have expired, e.g. because the process holding them was killed.
+
+        Returns:
+            The number of reclaimed backfills.
+        """
+        q = """UPDATE backfill_status SET lease_owner=NULL, lease_expires=NULL
+            WHERE lease_expires < $1
+            RETURNING twid"""
+        rows = await cls.db.fetch(q, int(time.time() * 1000))
+        return len(rows)
+
+    @classmethod
+    async def bump(cls, twid: str, receiver: int, priority: int, last_activity: int) -> bool:
+        """
+        Move an unfinished backfill forward in the queue.
+
+        Args:
+            twid: The conversation ID of the portal.
+            receiver: The receiver of the portal.
+            priority: The new priority of the backfill.
+            last_activity: The time of the activity in milliseconds.
 
+        Returns:
+            ``True`` if the portal has an unfinished backfill that was bumped.
+        """
+        q = """UPDATE backfill_status SET priority=$3, last_activity=$4
+            WHERE twid=$1 AND receiver=$2 AND state < 2
+            RETURNING twid"""
+        return await cls.db.fetchval(q, twid, receiver, priority, last_activity) is not None
+
+    @classmethod
+    async def get_by_twid(cls, twid: int, receiver: int = 0) -> BackfillStatus | None:
+        q = f"SELECT {cls.columns} FROM backfill_status WHERE twid=$1 AND receiver=$2"
         row = await cls.db.fetchrow(q, twid, receiver)
         if not row:
             return None
         return cls(**row)
 
     @classmethod
-    async def get_next_unfinished_status(cls) -> BackfillStatus | None:
-        q = """SELECT twid, receiver, backfill_user, dispatched, message_count, state FROM backfill_status
-        WHERE dispatched IS FALSE
-        AND state < 2
-        ORDER BY state ASC, message_count ASC
-        LIMIT 1"""
-        row = await cls.db.fetchrow(q)
+    async def claim_next(
+        cls, owner: str, duration: int, exclude_users: Collection[int] = ()
+    ) -> BackfillStatus | None:
+        """
+        Atomically find the next unfinished backfill that isn't leased and take a lease on it,
+        so that concurrent workers (in this process or another one) never claim the same portal.
+
+        Claiming resets the priority of the backfill to :attr:`PRIORITY_NORMAL`. A bump only
+        moves the next page of the portal forward, so that one user interaction doesn't keep
+        a long history ahead of every other portal until it's finished.
+
+        Args:
+            owner: A token that is unique to this claim, used to check that the lease is still
+                held when the result is written.
+            duration: The number of milliseconds the lease should be valid for.
+            exclude_users: Backfill users whose portals should be skipped, e.g. because they
+                already have as many backfills running as they're allowed to.
+
+        Returns:
+            The claimed backfill status, or ``None`` if there's nothing to do.
+        """
+        now = int(time.time() * 1000)
+        exclude = ""
+        if exclude_users:
+            placeholders = ", ".join(f"${i + 5}" for i in range(len(exclude_users)))
+            exclude = f"AND backfill_user NOT IN ({placeholders})"
+        # SQLite doesn't support row locks, but it only allows one writer at a time,
+        # so the UPDATE with a subselect is atomic there as well.
+        lock = "FOR UPDATE SKIP LOCKED" if cls.db.scheme == Scheme.POSTGRES else ""
+        q = f"""
+            UPDATE backfill_status SET lease_owner=$1, lease_expires=$2, priority=$4
+            WHERE (twid, receiver) IN (
+                SELECT twid, receiver FROM backfill_status
+                WHERE (lease_expires IS NULL OR lease_expires < $3) AND not_before <= $3
+                    AND state < 2 {exclude}
+                ORDER BY {cls.queue_order}
+                LIMIT 1
+                {lock}
+            )
+            RETURNING {cls.columns}
+        """
+        row = await cls.db.fetchrow(
+            q, owner, now + duration, now, cls.PRIORITY_NORMAL, *exclude_users
+        )
         if not row:
             return None
         return cls(**row)
@@ -0,0 +1,144 @@
+# mautrix-twitter - A Matrix-Twitter DM puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, ClassVar
+from collections import OrderedDict
+import json
+import time
+
+from attr import dataclass
+
+from mautrix.types import ContentURI, EncryptedFile
+from mautrix.util.async_db import Database
+from mautrix.util.opt_prometheus import Counter
+
+fake_db = Database.create("") if TYPE_CHECKING else None
+
+METRIC_CACHE = Counter(
+    "bridge_media_cache_lookups", "Lookups from the reuploaded media cache", ["result"]
+)
+
+
+@dataclass
+class MediaCache:
+    """
+    A previously reuploaded Twitter media file. Unencrypted uploads can be reused anywhere and are
+    stored with an empty ``mx_room``, while encrypted uploads are only reused in the same room.
+    """
+
+    db: ClassVar[Database] = fake_db
+
+    # Entries older than this many seconds are not reused
+    ttl: ClassVar[int] = 7 * 24 * 60 * 60
+    # How often the last_used timestamp of an entry is updated in the database
+    touch_interval: ClassVar[int] = 60 * 60
+    # Maximum number of entries to keep in memory
+    memory_size: ClassVar[int] = 1000
+    _memory: ClassVar[OrderedDict[tuple[str, str], MediaCache]] = OrderedDict()
+
+    url: str
+    mx_room: str
+    mxc: ContentURI
+    mime_type: str
+    file_name: str
+    size: int | None
+    content_hash: str | None
+    decryption_info: str | None
+    last_used: int
+
+    @property
+    def _values(self):
+        return (
+            self.url,
+            self.mx_room,
+            self.mxc,
+            self.mime_type,
+            self.file_name,
+            self.size,
+            self.content_hash,
+            self.decryption_info,
+            self.last_used,
+        )
+
+    columns: ClassVar[str] = (
+        "url, mx_room, mxc, mime_type, file_name, size, content_hash, decryption_info, "
+        "last_used"
+    )
+
+    @property
+    def encrypted_file(self) -> EncryptedFile | None:
+        if not self.decryption_info:
+            return None
+        return EncryptedFile.deserialize(json.loads(self.decryption_info))
+
+    @classmethod
+    def _remember(cls, entry: MediaCache) -> None:
+        if cls.memory_size <= 0:
+            return
+        key = (entry.url, entry.mx_room)
+        cls._memory[key] = entry
+        cls._memory.move_to_end(key)
+        while len(cls._memory) > cls.memory_size:
+            cls._memory.popitem(last=False)
+
+    async def upsert(self) -> None:
+        q = f"""
+            INSERT INTO media_cache ({self.columns}) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            ON CONFLICT (url, mx_room) DO UPDATE
+                SET mxc=excluded.mxc, mime_type=excluded.mime_type,
+                    file_name=excluded.file_name, size=excluded.size,
+                    content_hash=excluded.content_hash, decryption_info=excluded.decryption_info,
+                    last_used=excluded.last_used
+        """
+        await self.db.execute(q, *self._values)
+        self._remember(self)
+
+    async def _touch(self) -> None:
+        now = int(time.time())
+        if now - self.last_used < self.touch_interval:
+            return
+        self.last_used = now
+        q = "UPDATE media_cache SET last_used=$3 WHERE url=$1 AND mx_room=$2"
+        await self.db.execute(q, self.url, self.mx_room, self.last_used)
+
+    @classmethod
+    async def get(cls, url: str, mx_room: str) -> MediaCache | None:
+        key = (url, mx_room)
+        try:
+            entry = cls._memory[key]
+        except KeyError:
+            q = f"SELECT {cls.columns} FROM media_cache WHERE url=$1 AND mx_room=$2"
+            row = await cls.db.fetchrow(q, url, mx_room)
+            entry = cls(**row) if row else None
+        else:
+            cls._memory.move_to_end(key)
+        if entry is None or entry.last_used < time.time() - cls.ttl:
+            cls._memory.pop(key, None)
+            METRIC_CACHE.labels(result="miss").inc()
+            return None
+        METRIC_CACHE.labels(result="hit").inc()
+        cls._remember(entry)
+        await entry._touch()
+        return entry
+
+    @classmethod
+    async def delete_expired(cls) -> None:
+        cutoff = int(time.time()) - cls.ttl
+        await cls.db.execute("DELETE FROM media_cache WHERE last_used<$1", cutoff)
+        for key, entry in list(cls._memory.items()):
+            if entry.last_used < cutoff:
+                del cls._memory[key]
@@ -15,51 +15,166 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, ClassVar, Iterable
+from collections import OrderedDict
 
 from attr import dataclass
 
 from mautrix.types import EventID, RoomID
-from mautrix.util.async_db import Database
+from mautrix.util.async_db import Database, Scheme
+from mautrix.util.opt_prometheus import Counter
+
+from .write_buffer import WriteBuffer
 
 fake_db = Database.create("") if TYPE_CHECKING else None
 
+METRIC_CACHE = Counter(
+    "bridge_message_cache_lookups", "Message lookups from the in-memory cache", ["index", "result"]
+)
+
 
 @dataclass
 class Message:
     db: ClassVar[Database] = fake_db
+    write_buffer: ClassVar[WriteBuffer[Message] | None] = None
+
+    # LRU cache of recently used messages, shared by all portals. Rows are stored as tuples and
+    # a new instance is returned for each lookup, so callers can't modify the cached values.
+    cache_size: ClassVar[int] = 10000
+    _cache_by_twid: ClassVar[OrderedDict[tuple[int, int], tuple]] = OrderedDict()
+    _cache_by_mxid: ClassVar[dict[tuple[EventID, RoomID], tuple[int, int]]] = {}
+    # Incremented whenever rows are removed from the cache. Lookups don't cache the row they read
+    # from the database if the generation changed in the meantime, as it may have been deleted.
+    _cache_generation: ClassVar[int] = 0
 
     mxid: EventID
     mx_room: RoomID
     twid: int
     receiver: int
 
+    _columns: ClassVar[tuple[str, ...]] = ("mxid", "mx_room", "twid", "receiver")
+    _insert_query: ClassVar[
+        str
+    ] = "INSERT INTO message (mxid, mx_room, twid, receiver) VALUES ($1, $2, $3, $4)"
+    _upsert_query: ClassVar[
+        str
+    ] = """
+        INSERT INTO message(mxid, mx_room, twid, receiver) VALUES($1, $2, $3, $4)
+        ON CONFLICT(twid, receiver) DO UPDATE SET twid=excluded.twid, receiver=excluded.receiver
+    """
+
+    @property
+    def _values(self):
+        return self.mxid, self.mx_room, self.twid, self.receiver
+
+    @classmethod
+    def _cache_put(cls, msg: Message, generation: int | None = None) -> None:
+        if cls.cache_size <= 0:
+            return
+        elif generation is not None and generation != cls._cache_generation:
+            return
+        key = (msg.twid, msg.receiver)
+        old = cls._cache_by_twid.pop(key, None)
+        if old is not None:
+            cls._cache_by_mxid.pop((old[0], old[1]), None)
+        cls._cache_by_twid[key] = msg._values
+        cls._cache_by_mxid[(msg.mxid, msg.mx_room)] = key
+        while len(cls._cache_by_twid) > cls.cache_size:
+            _, evicted = cls._cache_by_twid.popitem(last=False)
+            cls._cache_by_mxid.pop((evicted[0], evicted[1]), None)
+
+    @classmethod
+    def _cache_remove(cls, twid: int, receiver: int) -> None:
+        cls._cache_generation += 1
+        old = cls._cache_by_twid.pop((twid, receiver), None)
+        if old is not None:
+            cls._cache_by_mxid.pop((old[0], old[1]), None)
+
+    @classmethod
+    def _cache_get(cls, key: tuple[int, int] | None) -> Message | None:
+        values = cls._cache_by_twid.get(key) if key is not None else None
+        if values is None:
+            return None
+        cls._cache_by_twid.move_to_end(key)
+        return cls(*values)
+
     async def insert(self) -> None:
-        q = "INSERT INTO message (mxid, mx_room, twid, receiver) VALUES ($1, $2, $3, $4)"
-        await self.db.execute(q, self.mxid, self.mx_room, self.twid, self.receiver)
+        await self.db.execute(self._insert_query, *self._values)
+        self._cache_put(self)
+
+    async def insert_buffered(self) -> None:
+        """
+        Insert the message through :attr:`write_buffer` if it's enabled, or directly otherwise.
+        In both cases, this returns after the row has been committed.
+        """
+        if self.write_buffer:
+            await self.write_buffer.add(self)
+        else:
+            await self.insert()
 
     async def upsert(self) -> None:
-        q = """
-            INSERT INTO message(mxid, mx_room, twid, receiver) VALUES($1, $2, $3, $4)
-            ON CONFLICT(twid, receiver) DO UPDATE SET twid=excluded.twid, receiver=excluded.receiver
+        # The upsert keeps the old mxid if the row exists, so the cache can't be filled here
+        self._cache_remove(self.twid, self.receiver)
+        await self.db.execute(self._upsert_query, *self._values)
+
+    @classmethod
+    async def bulk_insert(cls, messages: Iterable[Message]) -> None:
         """
-        await self.db.execute(q, self.mxid, self.mx_room, self.twid, self.receiver)
+        Insert many messages in one transaction. Postgres uses ``COPY``, other databases insert
+        the rows with ``executemany``.
+        """
+        messages = list(messages)
+        if not messages:
+            return
+        records = [msg._values for msg in messages]
+        async with cls.db.acquire() as conn, conn.transaction():
+            if cls.db.scheme == Scheme.POSTGRES:
+                await conn.copy_records_to_table("message", records=records, columns=cls._columns)
+            else:
+                await conn.executemany(cls._insert_query, records)
+        for msg in messages:
+            cls._cache_put(msg)
+
+    @classmethod
+    async def bulk_upsert(cls, messages: Iterable[Message]) -> None:
+        """Upsert many messages in one transaction using ``executemany``."""
+        messages = list(messages)
+        if not messages:
+            return
+        for msg in messages:
+            cls._cache_remove(msg.twid, msg.receiver)
+        async with cls.db.acquire() as conn, conn.transaction():
+            await conn.executemany(cls._upsert_query, [msg._values for msg in messages])
 
     async def delete(self) -> None:
         q = "DELETE FROM message WHERE twid=$1 AND receiver=$2"
         await self.db.execute(q, self.twid, self.receiver)
+        # Removed after the delete, so that lookups which overlapped it don't keep the row
+        self._cache_remove(self.twid, self.receiver)
 
     @classmethod
     async def delete_all(cls, room_id: RoomID) -> None:
         await cls.db.execute("DELETE FROM message WHERE mx_room=$1", room_id)
+        cls._cache_generation += 1
+        keys = [key for (_, mx_room), key in cls._cache_by_mxid.items() if mx_room == room_id]
+        for twid, receiver in keys:
+            cls._cache_remove(twid, receiver)
 
     @classmethod
     async def get_by_mxid(cls, mxid: EventID, mx_room: RoomID) -> Message | None:
+        msg = cls._cache_get(cls._cache_by_mxid.get((mxid, mx_room)))
+        if msg is not None:
+            METRIC_CACHE.labels(index="mxid", result="hit").inc()
+            return msg
+        METRIC_CACHE.labels(index="mxid", result="miss").inc()
+        generation = cls._cache_generation
         q = "SELECT mxid, mx_room, twid, receiver FROM message WHERE mxid=$1 AND mx_room=$2"
         row = await cls.db.fetchrow(q, mxid, mx_room)
         if not row:
             return None
-        return cls(**row)
+        msg = cls(**row)
+        cls._cache_put(msg, generation)
+        return msg
 
     @classmethod
     async def get_last(cls, mx_room: RoomID) -> Message | None:
@@ -79,8 +194,16 @@ class Message:
 
     @classmethod
     async def get_by_twid(cls, twid: int, receiver: int = 0) -> Message | None:
+        msg = cls._cache_get((twid, receiver))
+        if msg is not None:
+            METRIC_CACHE.labels(index="twid", result="hit").inc()
+            return msg
+        METRIC_CACHE.labels(index="twid", result="miss").inc()
+        generation = cls._cache_generation
         q = "SELECT mxid, mx_room, twid, receiver FROM message WHERE twid=$1 AND receiver=$2"
         row = await cls.db.fetchrow(q, twid, receiver)
         if not row:
             return None
-        return cls(**row)
+        msg = cls(**row)
+        cls._cache_put(msg, generation)
+        return msg
@@ -45,6 +45,10 @@ class Puppet:
 
     contact_info_set: bool
 
+    photo_hash: str | None
+    photo_etag: str | None
+    photo_last_modified: str | None
+
     @property
     def _values(self):
         return (
@@ -58,17 +62,20 @@ class Puppet:
             self.next_batch,
             str(self.base_url) if self.base_url else None,
             self.contact_info_set,
+            self.photo_hash,
+            self.photo_etag,
+            self.photo_last_modified,
         )
 
     columns: ClassVar[str] = (
         "twid, name, photo_url, photo_mxc, is_registered, custom_mxid, access_token, next_batch, "
-        "base_url, contact_info_set"
+        "base_url, contact_info_set, photo_hash, photo_etag, photo_last_modified"
     )
 
     async def insert(self) -> None:
         q = f"""
             INSERT INTO puppet ({self.columns})
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
         """
         await self.db.execute(q, *self._values)
 
@@ -76,7 +83,8 @@ class Puppet:
         q = """
             UPDATE puppet
             SET name=$2, photo_url=$3, photo_mxc=$4, is_registered=$5, custom_mxid=$6,
-                access_token=$7, next_batch=$8, base_url=$9, contact_info_set=$10
+                access_token=$7, next_batch=$8, base_url=$9, contact_info_set=$10,
+                photo_hash=$11, photo_etag=$12, photo_last_modified=$13
             WHERE twid=$1
         """
         await self.db.execute(q, *self._values)
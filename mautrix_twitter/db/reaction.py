@@ -15,13 +15,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, ClassVar
+from typing import TYPE_CHECKING, ClassVar, Iterable
 
 from attr import dataclass
 import asyncpg
 
 from mautrix.types import EventID, RoomID
-from mautrix.util.async_db import Database
+from mautrix.util.async_db import Database, Scheme
 from mautwitdm.types import ReactionKey
 
 fake_db = Database.create("") if TYPE_CHECKING else None
@@ -39,13 +39,23 @@ class Reaction:
     reaction: str
     tw_reaction_id: int
 
-    async def insert(self) -> None:
-        q = (
-            "INSERT INTO reaction (mxid, mx_room, tw_msgid, tw_receiver, tw_sender, reaction, tw_reaction_id) "
-            "VALUES ($1, $2, $3, $4, $5, $6, $7)"
-        )
-        await self.db.execute(
-            q,
+    _columns: ClassVar[tuple[str, ...]] = (
+        "mxid",
+        "mx_room",
+        "tw_msgid",
+        "tw_receiver",
+        "tw_sender",
+        "reaction",
+        "tw_reaction_id",
+    )
+    _insert_query: ClassVar[str] = (
+        "INSERT INTO reaction (mxid, mx_room, tw_msgid, tw_receiver, tw_sender, reaction, tw_reaction_id) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7)"
+    )
+
+    @property
+    def _values(self):
+        return (
             self.mxid,
             self.mx_room,
             self.tw_msgid,
@@ -55,6 +65,24 @@ class Reaction:
             self.tw_reaction_id,
         )
 
+    async def insert(self) -> None:
+        await self.db.execute(self._insert_query, *self._values)
+
+    @classmethod
+    async def bulk_insert(cls, reactions: Iterable[Reaction]) -> None:
+        """
+        Insert many reactions in one transaction. Postgres uses ``COPY``, other databases insert
+        the rows with ``executemany``.
+        """
+        records = [reaction._values for reaction in reactions]
+        if not records:
+            return
+        async with cls.db.acquire() as conn, conn.transaction():
+            if cls.db.scheme == Scheme.POSTGRES:
+                await conn.copy_records_to_table("reaction", records=records, columns=cls._columns)
+            else:
+                await conn.executemany(cls._insert_query, records)
+
     async def update_id(self, tw_reaction_id: int) -> None:
         q = (
             "UPDATE reaction SET tw_reaction_id=$1 "
@@ -190,3 +190,64 @@ async def upgrade_v8(conn: Connection, scheme: Scheme) -> None:
             WHEN reaction='emoji' THEN ''
         END"""
     )
+
+
+@upgrade_table.register(description="Add cache for reuploaded media")
+async def upgrade_v9(conn: Connection) -> None:
+    await conn.execute(
+        """CREATE TABLE media_cache (
+            url             TEXT,
+            mx_room         TEXT,
+            mxc             TEXT NOT NULL,
+            mime_type       TEXT NOT NULL,
+            file_name       TEXT NOT NULL,
+            size            BIGINT,
+            content_hash    TEXT,
+            decryption_info TEXT,
+            last_used       BIGINT NOT NULL,
+
+            PRIMARY KEY (url, mx_room)
+        )"""
+    )
+    await conn.execute("CREATE INDEX media_cache_last_used_idx ON media_cache (last_used)")
+
+
+@upgrade_table.register(description="Store avatar hash and HTTP cache headers of puppets")
+async def upgrade_v10(conn: Connection) -> None:
+    await conn.execute("ALTER TABLE puppet ADD COLUMN photo_hash TEXT")
+    await conn.execute("ALTER TABLE puppet ADD COLUMN photo_etag TEXT")
+    await conn.execute("ALTER TABLE puppet ADD COLUMN photo_last_modified TEXT")
+
+
+@upgrade_table.register(description="Add priority and activity columns to backfill queue")
+async def upgrade_v11(conn: Connection) -> None:
+    await conn.execute(
+        "ALTER TABLE backfill_status ADD COLUMN priority INTEGER NOT NULL DEFAULT 0"
+    )
+    await conn.execute(
+        "ALTER TABLE backfill_status ADD COLUMN last_activity BIGINT NOT NULL DEFAULT 0"
+    )
+    await conn.execute(
+        "CREATE INDEX backfill_status_queue_idx ON backfill_status "
+        "(priority DESC, last_activity DESC) WHERE state < 2"
+    )
+
+
+@upgrade_table.register(description="Replace backfill dispatched flag with leases")
+async def upgrade_v12(conn: Connection) -> None:
+    await conn.execute("ALTER TABLE backfill_status ADD COLUMN lease_owner TEXT")
+    await conn.execute("ALTER TABLE backfill_status ADD COLUMN lease_expires BIGINT")
+    # Rows that were left dispatched by a crashed process become claimable again
+    await conn.execute("ALTER TABLE backfill_status DROP COLUMN dispatched")
+
+
+@upgrade_table.register(description="Store history backfill cursor")
+async def upgrade_v13(conn: Connection) -> None:
+    await conn.execute("ALTER TABLE backfill_status ADD COLUMN min_entry_id TEXT")
+
+
+@upgrade_table.register(description="Add per-portal backfill pacing")
+async def upgrade_v14(conn: Connection) -> None:
+    await conn.execute(
+        "ALTER TABLE backfill_status ADD COLUMN not_before BIGINT NOT NULL DEFAULT 0"
+    )
@@ -0,0 +1,129 @@
+# mautrix-twitter - A Matrix-Twitter DM puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Generic, TypeVar
+import asyncio
+import logging
+
+T = TypeVar("T")
+
+
+class WriteBuffer(Generic[T]):
+    """
+    Collects rows that are written concurrently and inserts them in batches.
+
+    A batch is flushed when it reaches ``max_size`` rows or when ``max_delay`` seconds have passed
+    since the first row was added. :meth:`add` only returns after the batch containing the row
+    has been committed, so callers can safely acknowledge the row (e.g. send a delivery receipt)
+    once it returns. If a batch fails, the rows are retried one by one so that an error only
+    affects the caller whose row caused it.
+    """
+
+    log: logging.Logger
+    max_size: int
+    max_delay: float
+
+    _insert_many: Callable[[list[T]], Awaitable[None]]
+    _insert_one: Callable[[T], Awaitable[None]]
+    _batch: list[tuple[T, asyncio.Future]]
+    _timer: asyncio.TimerHandle | None
+    _flush_lock: asyncio.Lock
+    _flush_tasks: set[asyncio.Task]
+
+    def __init__(
+        self,
+        insert_many: Callable[[list[T]], Awaitable[None]],
+        insert_one: Callable[[T], Awaitable[None]],
+        max_size: int = 100,
+        max_delay: float = 0.05,
+        log: logging.Logger | None = None,
+    ) -> None:
+        self.log = log or logging.getLogger("mau.db.write_buffer")
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._insert_many = insert_many
+        self._insert_one = insert_one
+        self._batch = []
+        self._timer = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_tasks = set()
+
+    async def add(self, item: T) -> None:
+        """
+        Add a row to the buffer and wait until it has been written.
+
+        Args:
+            item: The row to write.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self._batch.append((item, fut))
+        if len(self._batch) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._start_flush)
+        # Don't let a cancelled caller cancel the write of the other rows in the batch
+        await asyncio.shield(fut)
+
+    def _start_flush(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._flush(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self) -> None:
+        """Write all buffered rows immediately and wait for all pending writes to finish."""
+        self._start_flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    async def _flush(self, batch: list[tuple[T, asyncio.Future]]) -> None:
+        # Flushes are serialized so that batches are committed in the order they were created
+        async with self._flush_lock:
+            try:
+                await self._insert_many([item for item, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    self._resolve(batch[0][1], e)
+                    return
+                self.log.warning(
+                    f"Failed to write batch of {len(batch)} rows, retrying individually",
+                    exc_info=True,
+                )
+                for item, fut in batch:
+                    try:
+                        await self._insert_one(item)
+                    except Exception as e:
+                        self._resolve(fut, e)
+                    else:
+                        self._resolve(fut)
+            else:
+                for _, fut in batch:
+                    self._resolve(fut)
+
+    @staticmethod
+    def _resolve(fut: asyncio.Future, error: Exception | None = None) -> None:
+        if fut.done():
+            return
+        elif error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(None)
@@ -131,6 +131,7 @@ class MatrixHandler(BaseMatrixHandler):
             return
         user.log.debug(f"Marking messages in {portal.twid} read up to {read_twid}")
         await user.client.conversation(portal.twid).mark_read(read_twid)
+        await portal.bump_backfill_priority()
 
     @staticmethod
     async def handle_typing(room_id: RoomID, typing: list[UserID]) -> None:
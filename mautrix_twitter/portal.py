@@ -18,15 +18,27 @@ from __future__ import annotations
 import asyncio
 import base64
 import hashlib
+import json
 import time
 from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime, timedelta
-from typing import TYPE_CHECKING, Any, AsyncGenerator, Awaitable, Literal, NamedTuple, cast
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Awaitable,
+    Literal,
+    NamedTuple,
+    cast,
+)
 
 import magic
+from aiohttp import ClientConnectionError, ClientPayloadError, ClientResponse, ClientResponseError
 from mautrix.appservice import DOUBLE_PUPPET_SOURCE_KEY, AppService, IntentAPI
 from mautrix.bridge import BasePortal, NotificationDisabler, async_getter_lock
-from mautrix.errors import MatrixError, MForbidden
+from mautrix.errors import MatrixError, MatrixRequestError, MForbidden
 from mautrix.types import (
     AudioInfo,
     BatchSendEvent,
@@ -48,42 +60,55 @@ from mautrix.types import (
     RelatesTo,
     RelationType,
     RoomID,
+    SpecVersions,
     TextMessageEventContent,
     ThumbnailInfo,
     VideoInfo,
 )
-from mautrix.util import background_task, ffmpeg, variation_selector
+from mautrix.util import background_task, variation_selector
 from mautrix.util.message_send_checkpoint import MessageSendCheckpointStatus
 from mautrix.util.simple_lock import SimpleLock
 from yarl import URL
 
 from mautwitdm.errors import UnsupportedAttachmentError
+from mautwitdm.ratelimit import RequestPriority
+from mautwitdm.twitter import DownloadStream
 from mautwitdm.types import (
     Conversation,
     ConversationType,
+    FetchConversationResponse,
+    MediaUploadResponse,
     MessageData,
     MessageEntry,
     Participant,
     ReactionCreateEntry,
+    TimelineStatus,
     VideoVariant,
 )
 from . import backfill as b, matrix as m, puppet as p, user as u
 from .config import Config
 from .db import (
     BackfillStatus as DBBackfillStatus,
+    MediaCache as DBMediaCache,
     Message as DBMessage,
     Portal as DBPortal,
     Reaction as DBReaction,
+    WriteBuffer,
 )
 from .formatter import twitter_to_matrix
+from .util import MediaWorkerPool
 
 if TYPE_CHECKING:
     from .__main__ import TwitterBridge
 
 try:
-    from mautrix.crypto.attachments import decrypt_attachment, encrypt_attachment
+    from mautrix.crypto.attachments import (
+        async_encrypt_attachment,
+        decrypt_attachment,
+        encrypt_attachment,
+    )
 except ImportError:
-    encrypt_attachment = decrypt_attachment = None
+    async_encrypt_attachment = encrypt_attachment = decrypt_attachment = None
 
 StateBridge = EventType.find("m.bridge", EventType.Class.STATE)
 StateHalfShotBridge = EventType.find("uk.half-shot.bridge", EventType.Class.STATE)
@@ -95,7 +120,94 @@ class ReuploadedMediaInfo(NamedTuple):
     decryption_info: EncryptedFile | None
     mime_type: str
     file_name: str
+    size: int | None
+
+
+class _MediaRelay:
+    """
+    Passes a download stream through to an upload, counting and hashing it and optionally
+    encrypting it.
+    """
+
     size: int
+    decryption_info: EncryptedFile | None
+
+    def __init__(self, data: AsyncIterable[bytes], encrypt: bool) -> None:
+        self._data = data
+        self._encrypt = encrypt
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.decryption_info = None
+
+    @property
+    def content_hash(self) -> str:
+        """The SHA-256 hash of the plaintext that has been passed through so far."""
+        return self._hash.hexdigest()
+
+    async def _count(self) -> AsyncGenerator[bytes, None]:
+        async for chunk in self._data:
+            self.size += len(chunk)
+            self._hash.update(chunk)
+            yield chunk
+
+    async def iter(self) -> AsyncGenerator[bytes, None]:
+        if not self._encrypt:
+            async for chunk in self._count():
+                yield chunk
+            return
+        async for chunk in async_encrypt_attachment(self._count()):
+            if isinstance(chunk, EncryptedFile):
+                self.decryption_info = chunk
+            else:
+                yield chunk
+
+
+async def _none() -> None:
+    return None
+
+
+async def _iter_bytes(data: bytes) -> AsyncGenerator[bytes, None]:
+    yield data
+
+
+async def _buffer_unsized(stream: DownloadStream) -> DownloadStream:
+    # Uploads are streamed with a Content-Length, so files without a known size are buffered
+    if stream.size is not None:
+        return stream
+    data = b"".join([chunk async for chunk in stream.data])
+    return stream._replace(data=_iter_bytes(data), size=len(data))
+
+
+def _is_transient_error(e: Exception) -> bool:
+    if isinstance(e, (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError)):
+        return True
+    elif isinstance(e, MatrixRequestError):
+        return e.http_status in (502, 503, 504)
+    elif isinstance(e, ClientResponseError):
+        return e.status in (502, 503, 504)
+    return False
+
+
+async def _peek_stream(
+    data: AsyncIterable[bytes], size: int
+) -> tuple[bytes, AsyncGenerator[bytes, None]]:
+    """Read at least ``size`` bytes from the start of a stream without consuming them."""
+    it = data.__aiter__()
+    head = bytearray()
+    try:
+        while len(head) < size:
+            head += await it.__anext__()
+    except StopAsyncIteration:
+        pass
+    head = bytes(head)
+
+    async def rest() -> AsyncGenerator[bytes, None]:
+        if head:
+            yield head
+        async for chunk in it:
+            yield chunk
+
+    return head, rest()
 
 
 class Portal(DBPortal, BasePortal):
@@ -116,6 +228,16 @@ class Portal(DBPortal, BasePortal):
     _main_intent: IntentAPI
     _last_participant_update: set[int]
     _reaction_lock: asyncio.Lock
+    _last_backfill_bump: float
+    # Limits the number of concurrent media transfers across all portals
+    media_semaphore: asyncio.Semaphore
+    # Runs media encryption, decryption and conversion outside the event loop
+    media_worker: MediaWorkerPool
+    # Minimum number of seconds between backfill priority bumps caused by user activity
+    backfill_bump_interval: float = 60
+    # Number of times a media reupload is retried after a transient error. Streamed uploads can't
+    # be replayed, so each retry downloads the file from Twitter again.
+    media_upload_retries: int = 3
 
     def __init__(
         self,
@@ -144,6 +266,7 @@ class Portal(DBPortal, BasePortal):
         self._reaction_dedup = deque(maxlen=100)
         self._reqid_dedup = set()
         self._last_participant_update = set()
+        self._last_backfill_bump = float("-inf")
 
         self.backfill_lock = SimpleLock(
             "Waiting for backfilling to finish before handling %s", log=self.log
@@ -179,9 +302,34 @@ class Portal(DBPortal, BasePortal):
         cls.private_chat_portal_meta = cls.config["bridge.private_chat_portal_meta"]
         NotificationDisabler.puppet_cls = p.Puppet
         NotificationDisabler.config_enabled = cls.config["bridge.backfill.disable_notifications"]
+        DBMessage.cache_size = cls.config["bridge.message_cache_size"]
+        DBMediaCache.ttl = cls.config["bridge.media_cache.ttl"]
+        DBMediaCache.memory_size = cls.config["bridge.media_cache.memory_size"]
+        cls.media_semaphore = asyncio.Semaphore(max(cls.config["bridge.media_concurrency"], 1))
+        cls.media_worker = MediaWorkerPool(
+            threads=cls.config["bridge.media_worker.threads"],
+            max_queued=cls.config["bridge.media_worker.max_queued"],
+            ffmpeg_processes=cls.config["bridge.media_worker.ffmpeg_processes"],
+        )
+        if cls.config["bridge.message_write_buffer.enabled"]:
+            DBMessage.write_buffer = WriteBuffer(
+                DBMessage.bulk_insert,
+                DBMessage.insert,
+                max_size=cls.config["bridge.message_write_buffer.max_size"],
+                max_delay=cls.config["bridge.message_write_buffer.max_delay"],
+            )
 
     # region Misc
 
+    @classmethod
+    async def expire_media_cache_loop(cls) -> None:
+        while True:
+            try:
+                await DBMediaCache.delete_expired()
+            except Exception:
+                cls.log.exception("Failed to delete expired media cache entries")
+            await asyncio.sleep(60 * 60)
+
     async def _send_delivery_receipt(self, event_id: EventID) -> None:
         if event_id and self.config["bridge.delivery_receipts"]:
             try:
@@ -321,6 +469,7 @@ class Portal(DBPortal, BasePortal):
             await self._send_bridge_success(
                 sender, event_id, EventType.ROOM_MESSAGE, message.msgtype
             )
+        await self.bump_backfill_priority()
 
     async def _handle_matrix_message(
         self, sender: u.User, message: MessageEventContent, event_id: EventID
@@ -329,7 +478,7 @@ class Portal(DBPortal, BasePortal):
             raise NotImplementedError("user is not connected")
         request_id = str(sender.client.new_request_id())
         self._reqid_dedup.add(request_id)
-        media_id = None
+        media_upload = None
         if message.msgtype == MessageType.TEXT:
             text = message.body
         elif message.msgtype == MessageType.EMOTE:
@@ -339,19 +488,9 @@ class Portal(DBPortal, BasePortal):
                 raise UnsupportedAttachmentError(
                     "Non-image/video files are not supported by Twitter"
                 )
-            if message.file and decrypt_attachment:
-                data = await self.main_intent.download_media(message.file.url)
-                data = decrypt_attachment(
-                    data,
-                    message.file.key.key,
-                    message.file.hashes.get("sha256"),
-                    message.file.iv,
-                )
-            else:
-                data = await self.main_intent.download_media(message.url)
-            mime_type = message.info.mimetype or magic.from_buffer(data, mime=True)
-            upload_resp = await sender.client.upload(data, mime_type=mime_type)
-            media_id = upload_resp.media_id
+            # Uploading and waiting for Twitter to process the media can take a while,
+            # so the rest of the message is prepared in the meantime.
+            media_upload = asyncio.create_task(self._upload_matrix_media(sender, message))
             filename = message.get("filename", None)
             if filename and filename != message.body:
                 text = message.body
@@ -359,21 +498,71 @@ class Portal(DBPortal, BasePortal):
                 text = ""
         else:
             raise NotImplementedError(f"unsupported msgtype '{message.msgtype.value}'")
-        reply_to = None
-        if message.get_reply_to():
-            reply_to_msg = await DBMessage.get_by_mxid(message.get_reply_to(), self.mxid)
-            if reply_to_msg:
-                reply_to = reply_to_msg.twid
+        try:
+            reply_to = None
+            if message.get_reply_to():
+                reply_to_msg = await DBMessage.get_by_mxid(message.get_reply_to(), self.mxid)
+                if reply_to_msg:
+                    reply_to = reply_to_msg.twid
+            media_id = (await media_upload).media_id if media_upload else None
+        finally:
+            if media_upload and not media_upload.done():
+                media_upload.cancel()
         resp = await sender.client.conversation(self.twid).send(
             text, media_id=media_id, request_id=request_id, reply_to_id=reply_to
         )
         resp_msg_id = int(resp.entries[0].message.id)
         self._msgid_dedup.appendleft(resp_msg_id)
         msg = DBMessage(mxid=event_id, mx_room=self.mxid, twid=resp_msg_id, receiver=self.receiver)
-        await msg.insert()
+        await msg.insert_buffered()
         self._reqid_dedup.remove(request_id)
         self.log.debug(f"Handled Matrix message {event_id} -> {resp_msg_id}")
 
+    async def _upload_matrix_media(
+        self, sender: u.User, message: MediaMessageEventContent
+    ) -> MediaUploadResponse:
+        # The file is streamed from the homeserver through decryption into the Twitter upload,
+        # so that only a few segments of it are held in memory at a time.
+        url = message.file.url if message.file and decrypt_attachment else message.url
+        async with self._download_matrix_media(url) as resp:
+            data: AsyncIterable[bytes] = resp.content.iter_chunked(64 * 1024)
+            if message.file and decrypt_attachment:
+                # AES-CTR doesn't change the size, so the content length matches either way
+                data = self.media_worker.decrypt_stream(data, message.file)
+            size = message.info.size or resp.content_length
+            mime_type = message.info.mimetype
+            if not mime_type:
+                head, data = await _peek_stream(data, 2048)
+                mime_type = magic.from_buffer(head, mime=True)
+            if not size:
+                # Twitter needs the total size upfront, so the file has to be buffered
+                buf = bytearray()
+                async for chunk in data:
+                    buf += chunk
+                return await sender.client.upload(bytes(buf), mime_type=mime_type)
+            return await sender.client.upload(data, mime_type=mime_type, size=size)
+
+    @asynccontextmanager
+    async def _download_matrix_media(
+        self, url: ContentURI
+    ) -> AsyncGenerator[ClientResponse, None]:
+        """
+        Like :meth:`IntentAPI.download_media`, but yields the response
+        instead of reading the whole file into memory.
+        """
+        api = self.main_intent.api
+        authenticated = (await self.main_intent.versions()).supports(SpecVersions.V111)
+        download_url = api.get_download_url(url, authenticated=authenticated)
+        query_params = {"allow_redirect": "true"}
+        headers = {}
+        if authenticated:
+            headers["Authorization"] = f"Bearer {api.token}"
+            if api.as_user_id:
+                query_params["user_id"] = api.as_user_id
+        async with api.session.get(download_url, params=query_params, headers=headers) as resp:
+            resp.raise_for_status()
+            yield resp
+
     async def handle_matrix_reaction(
         self, sender: u.User, event_id: EventID, reacting_to: EventID, reaction: str
     ) -> None:
@@ -495,22 +684,26 @@ class Portal(DBPortal, BasePortal):
             reply_to_msg = await DBMessage.get_by_twid(int(message.reply_data.id), self.receiver)
         else:
             reply_to_msg = None
-        media_content = None
-        if message.attachment and message.attachment.media:
-            media_content = await self._handle_twitter_media(source, intent, message)
-            if media_content:
-                if reply_to_msg:
-                    media_content.set_reply(reply_to_msg.mxid)
-                converted.append(media_content)
-        if message.text and not message.text.isspace():
+        has_media = bool(message.attachment and message.attachment.media)
+        if has_media:
+            self._remove_media_link(message)
+        has_text = bool(message.text and not message.text.isspace())
+        # The media and link preview are independent transfers, so they're reuploaded in parallel
+        media_content, link_previews = await asyncio.gather(
+            self._handle_twitter_media(source, intent, message) if has_media else _none(),
+            self._twitter_preview_to_beeper(source, intent, message) if has_text else _none(),
+        )
+        if media_content:
+            if reply_to_msg:
+                media_content.set_reply(reply_to_msg.mxid)
+            converted.append(media_content)
+        if has_text:
             text_content = await twitter_to_matrix(message)
             other_user = await u.User.get_by_twid(int(sender.twid))
             self.log.debug(f"Found other_user {other_user} for {sender.twid}")
             if other_user is not None:
                 text_content["mx_sender_id"] = other_user.mxid
-            text_content["com.beeper.linkpreviews"] = await self._twitter_preview_to_beeper(
-                source, intent, message
-            )
+            text_content["com.beeper.linkpreviews"] = link_previews
             if reply_to_msg:
                 text_content.set_reply(reply_to_msg.mxid)
             if media_content and self.config["bridge.caption_in_message"]:
@@ -538,7 +731,7 @@ class Portal(DBPortal, BasePortal):
                 twid=msg_id,
                 receiver=self.receiver,
             )
-            await msg.insert()
+            await msg.insert_buffered()
             await self._send_delivery_receipt(event_id)
             self.log.debug(f"Handled Twitter message {msg_id} -> {event_id}")
 
@@ -644,10 +837,8 @@ class Portal(DBPortal, BasePortal):
         self, source: u.User, intent: IntentAPI, message: MessageData
     ) -> MediaMessageEventContent | None:
         media = message.attachment.media
-        reuploaded_info = await self._reupload_twitter_media(source, media.media_url_https, intent)
         thumbnail_info = None
         if media.video_info:
-            thumbnail_info = reuploaded_info
             best_variant = None
             for variant in media.video_info.variants:
                 if (
@@ -656,8 +847,15 @@ class Portal(DBPortal, BasePortal):
                     or self._is_better_mime(best_variant, variant)
                 ):
                     best_variant = variant
+            thumbnail_info, reuploaded_info = await asyncio.gather(
+                self._reupload_twitter_media(source, media.media_url_https, intent),
+                self._reupload_twitter_media(
+                    source, best_variant.url, intent, convert_to_audio=media.audio_only
+                ),
+            )
+        else:
             reuploaded_info = await self._reupload_twitter_media(
-                source, best_variant.url, intent, convert_to_audio=media.audio_only
+                source, media.media_url_https, intent
             )
         content = MediaMessageEventContent(
             body=reuploaded_info.file_name,
@@ -712,34 +910,179 @@ class Portal(DBPortal, BasePortal):
                 width=media.original_info.width,
                 height=media.original_info.height,
             )
-        # Remove the attachment link from message.text
+        return content
+
+    @staticmethod
+    def _remove_media_link(message: MessageData) -> None:
+        media = message.attachment.media
         start, end = media.indices
         message.text = message.text[:start] + message.text[end:]
         if message.entities and message.entities.urls:
             message.entities.urls = [u for u in message.entities.urls if u.url != media.url]
-        return content
 
     async def _reupload_twitter_media(
         self, source: u.User, url: str, intent: IntentAPI, convert_to_audio: bool = False
     ) -> ReuploadedMediaInfo:
         file_name = URL(url).name
-        data, mime_type = await source.client.download_media(url)
-
-        if convert_to_audio and (mime_type.startswith("video/") or mime_type.startswith("audio/")):
-            data = await ffmpeg.convert_bytes(
-                data,
-                ".ogg",
-                output_args=("-c:a", "libopus"),
-                input_mime=mime_type,
+        encrypt = bool(self.encrypted and async_encrypt_attachment)
+        # Encrypted uploads are only reused in the same room
+        cache_room = self.mxid if encrypt else ""
+        use_cache = self.config["bridge.media_cache.enabled"] and not convert_to_audio
+        if use_cache:
+            cached = await DBMediaCache.get(url, cache_room)
+            if cached:
+                self.log.debug(f"Reusing cached upload {cached.mxc} of {url}")
+                decryption_info = cached.encrypted_file
+                return ReuploadedMediaInfo(
+                    None if decryption_info else cached.mxc,
+                    decryption_info,
+                    cached.mime_type,
+                    cached.file_name,
+                    cached.size,
+                )
+
+        # The stack holds the media slot and the Twitter response. It's closed here unless a
+        # background upload took it over, in which case the upload closes it when it finishes.
+        stack = AsyncExitStack()
+        handed_over = False
+        try:
+            await stack.enter_async_context(self.media_semaphore)
+            stream = await stack.enter_async_context(source.client.stream_media(url))
+            mime_type = stream.mime_type
+            if convert_to_audio and (
+                mime_type.startswith("video/") or mime_type.startswith("audio/")
+            ):
+                # ffmpeg needs the whole file anyway, so converted audio is still buffered
+                data = await self.media_worker.convert_bytes(
+                    b"".join([chunk async for chunk in stream.data]),
+                    ".ogg",
+                    output_args=("-c:a", "libopus"),
+                    input_mime=mime_type,
+                )
+                return await self._reupload_buffered_media(
+                    intent, data, "audio/ogg", file_name + ".ogg"
+                )
+            stream = await _buffer_unsized(stream)
+
+            upload_mime_type = mime_type
+            upload_file_name = file_name
+            async_upload = self.config["homeserver.async_media"]
+            if encrypt:
+                upload_mime_type = "application/octet-stream"
+                upload_file_name = None
+                # The hash of the encrypted file is only known after the whole file has been
+                # uploaded, so encrypted media can't be uploaded in the background.
+                async_upload = False
+
+            if async_upload:
+                mxc = (await intent.create_mxc()).content_uri
+                upload = self._upload_twitter_stream(
+                    source, url, intent, stream, False, upload_mime_type, upload_file_name, mxc
+                )
+                self._upload_in_background(stack, upload, mxc)
+                handed_over = True
+                # Background uploads may still fail, so they aren't cached
+                return ReuploadedMediaInfo(mxc, None, mime_type, file_name, stream.size)
+
+            mxc, relay = await self._upload_twitter_stream(
+                source, url, intent, stream, encrypt, upload_mime_type, upload_file_name
             )
-            mime_type = "audio/ogg"
-            file_name += ".ogg"
+        finally:
+            if not handed_over:
+                await stack.aclose()
+
+        size = relay.size
+        if use_cache:
+            await DBMediaCache(
+                url=url,
+                mx_room=cache_room,
+                mxc=mxc,
+                mime_type=mime_type,
+                file_name=file_name,
+                size=size,
+                content_hash=relay.content_hash,
+                decryption_info=(
+                    json.dumps({**relay.decryption_info.serialize(), "url": mxc})
+                    if relay.decryption_info
+                    else None
+                ),
+                last_used=int(time.time()),
+            ).upsert()
+
+        decryption_info = relay.decryption_info
+        if decryption_info:
+            decryption_info.url = mxc
+            mxc = None
+
+        return ReuploadedMediaInfo(mxc, decryption_info, mime_type, file_name, size)
+
+    async def _upload_twitter_stream(
+        self,
+        source: u.User,
+        url: str,
+        intent: IntentAPI,
+        stream: DownloadStream,
+        encrypt: bool,
+        mime_type: str,
+        file_name: str | None,
+        mxc: ContentURI | None = None,
+    ) -> tuple[ContentURI, _MediaRelay]:
+        for attempt in range(self.media_upload_retries + 1):
+            async with AsyncExitStack() as stack:
+                if attempt > 0:
+                    # The previous attempt consumed (part of) the stream, so download it again
+                    stream = await stack.enter_async_context(source.client.stream_media(url))
+                    stream = await _buffer_unsized(stream)
+                relay = _MediaRelay(stream.data, encrypt=encrypt)
+                try:
+                    uploaded_mxc = await intent.upload_media(
+                        relay.iter(),
+                        mime_type=mime_type,
+                        filename=file_name,
+                        size=stream.size,
+                        mxc=mxc,
+                    )
+                    return uploaded_mxc, relay
+                except Exception as e:
+                    if attempt >= self.media_upload_retries or not _is_transient_error(e):
+                        raise
+                    delay = 2**attempt
+                    self.log.warning(
+                        f"Failed to reupload {url} ({type(e).__name__}: {e}), "
+                        f"retrying in {delay} seconds"
+                    )
+            await asyncio.sleep(delay)
+
+    def _upload_in_background(
+        self, stack: AsyncExitStack, upload: Awaitable, mxc: ContentURI
+    ) -> None:
+        started = False
 
+        async def run() -> None:
+            nonlocal started
+            started = True
+            async with stack:
+                try:
+                    await upload
+                except Exception:
+                    self.log.exception(f"Failed to upload {mxc} in the background")
+
+        def done(_: asyncio.Task) -> None:
+            # A task that's cancelled before it starts never enters the stack
+            if not started:
+                upload.close()
+                background_task.create(stack.aclose())
+
+        background_task.create(run()).add_done_callback(done)
+
+    async def _reupload_buffered_media(
+        self, intent: IntentAPI, data: bytes, mime_type: str, file_name: str
+    ) -> ReuploadedMediaInfo:
         upload_mime_type = mime_type
         upload_file_name = file_name
         decryption_info = None
         if self.encrypted and encrypt_attachment:
-            data, decryption_info = encrypt_attachment(data)
+            data, decryption_info = await self.media_worker.encrypt(data)
             upload_mime_type = "application/octet-stream"
             upload_file_name = None
 
@@ -903,34 +1246,24 @@ class Portal(DBPortal, BasePortal):
     # endregion
     # region Backfilling
 
-    async def backfill(self, source: u.User, is_initial: bool = False) -> int:
+    async def backfill(
+        self, source: u.User, is_initial: bool = False, status: DBBackfillStatus | None = None
+    ) -> int:
         limit = self.config["bridge.backfill.initial_limit"]
         if limit == 0:
             return 0
         elif limit < 0:
             limit = None
         with self.backfill_lock:
-            return await self._backfill(source, limit, is_initial)
+            if is_initial:
+                return await self._backfill(source, limit, status)
+            return await self._backfill_history(source, limit, status)
 
-    async def _backfill(self, source: u.User, limit: int, is_initial: bool = False) -> int:
-        if is_initial:
-            self.log.debug("Backfilling initial batch through %s", source.mxid)
-        elif not self.config["bridge.backfill.backwards"]:
-            self.log.debug("Not backfilling history, disabled in config")
-            return 0
-        else:
-            self.log.debug("Backfilling history through %s", source.mxid)
-
-        first_message = await DBMessage.get_first(self.mxid)
-        max_id = None
-        if not is_initial:
-            if first_message is not None:
-                max_id = first_message.twid
-            else:
-                self.log.warning("Can't backfill without a first bridged message")
-                raise b.NoFirstMessageException()
-
-        mark_read, entries = await self._fetch_backfill_entries(source, limit, max_id)
+    async def _backfill(
+        self, source: u.User, limit: int | None, status: DBBackfillStatus | None = None
+    ) -> int:
+        self.log.debug("Backfilling initial batch through %s", source.mxid)
+        mark_read, entries, cursor = await self._fetch_backfill_entries(source, limit)
         if not entries:
             self.log.debug("Didn't get any entries from server")
             return 0
@@ -939,9 +1272,7 @@ class Portal(DBPortal, BasePortal):
 
         filled = 0
         if self.config["bridge.backfill.backwards"]:
-            filled = await self._batch_handle_backfill(
-                source, reversed(entries), is_initial, mark_read
-            )
+            filled = await self._batch_handle_backfill(source, reversed(entries), True, mark_read)
         else:
             backfill_leave = await self._invite_own_puppet_backfill(source)
             async with NotificationDisabler(self.mxid, source):
@@ -951,69 +1282,197 @@ class Portal(DBPortal, BasePortal):
             for intent in backfill_leave:
                 self.log.trace("Leaving room with %s post-backfill", intent.mxid)
                 await intent.leave_room(self.mxid)
+        if status is not None:
+            # History backfill continues from where the initial batch stopped
+            status.min_entry_id = cursor
+            if not await status.save_cursor():
+                self.log.warning("Backfill lease was lost, history will continue elsewhere")
         self.log.info(
             "Backfilled %d messages (%d events) through %s", len(entries), filled, source.mxid
         )
         return filled
 
-    async def _fetch_backfill_entries(
-        self, source: u.User, limit: int, max_id: int | None = None
-    ) -> tuple[bool, list[MessageEntry | ReactionCreateEntry]]:
-        conv = source.client.conversation(self.twid)
-        entries: list[MessageEntry | ReactionCreateEntry] = []
+    async def _backfill_history(
+        self, source: u.User, limit: int | None, status: DBBackfillStatus | None = None
+    ) -> int:
+        if not self.config["bridge.backfill.backwards"]:
+            self.log.debug("Not backfilling history, disabled in config")
+            return 0
+        self.log.debug("Backfilling history through %s", source.mxid)
+
+        first_message = await DBMessage.get_first(self.mxid)
+        if first_message is None:
+            self.log.warning("Can't backfill without a first bridged message")
+            raise b.NoFirstMessageException()
+        cursor = status.min_entry_id if status is not None else None
+        if cursor is None:
+            cursor = str(first_message.twid)
+        else:
+            self.log.debug("Resuming history backfill from %s", cursor)
+
+        filled = 0
         message_count = 0
-        self.log.debug("Fetching up to %d messages through %s", limit, source.twid)
+        mark_read = None
+        # Every page is sent as its own batch as soon as it's fetched, and the cursor is saved
+        # after each one, so memory use doesn't grow with the limit and an interrupted backfill
+        # continues from the last sent page.
+        pages = self._iter_backfill_pages(source, cursor)
         try:
-            mark_read = False
-            self.log.debug("Fetching with max_id %s", max_id)
-            resp = await conv.fetch(max_id=max_id)
-            resp_entries = (
-                list(filter(lambda x: x is not None, resp.entries))
-                if resp.entries is not None
-                else None
-            )
+            async for resp, page in pages:
+                if mark_read is None:
+                    mark_read = self._should_mark_backfill_read(resp, page)
+                page, page_messages, next_cursor = self._limit_backfill_page(
+                    resp, page, None if limit is None else limit - message_count
+                )
+                cursor = next_cursor or cursor
+                message_count += page_messages
+                if page:
+                    page.sort(key=lambda ent: (ent.time, ent.id))
+                    self.log.debug("Sending page of %d history entries", len(page))
+                    filled += await self._batch_handle_backfill(
+                        source, page, False, mark_read, first_event=first_message.mxid
+                    )
+                if status is not None:
+                    status.min_entry_id = cursor
+                    if not await status.save_cursor():
+                        # Another worker took over, continuing would send the same history twice
+                        self.log.warning("Backfill lease was lost, stopping history backfill")
+                        break
+                if limit is not None and message_count >= limit:
+                    break
+        finally:
+            # Stop prefetching right away if the limit was reached
+            await pages.aclose()
+        self.log.info(
+            "Backfilled %d history messages (%d events) through %s",
+            message_count,
+            filled,
+            source.mxid,
+        )
+        return filled
+
+    async def _iter_backfill_pages(
+        self, source: u.User, max_id: str | None = None, prefetch: int | None = None
+    ) -> AsyncGenerator[
+        tuple[FetchConversationResponse, list[MessageEntry | ReactionCreateEntry]], None
+    ]:
+        conv = source.client.conversation(self.twid)
+        # Up to this many pages are fetched while the caller is still converting and sending
+        # the current page. The requests still go through the account's rate limit budget.
+        if prefetch is None:
+            prefetch = self.config["bridge.backfill.prefetch_pages"]
+        slots = asyncio.Semaphore(max(prefetch, 0) + 1)
+        pages: asyncio.Queue[FetchConversationResponse | Exception | None] = asyncio.Queue()
+
+        async def fetch_pages() -> None:
+            nonlocal max_id
             try:
-                if datetime.now() - timedelta(days=30) > datetime.fromtimestamp(
-                    resp.conversations[self.twid].sort_timestamp
-                ) or (
-                    resp_entries is not None
-                    and len(resp_entries) != 0
-                    and int(resp.conversations[self.twid].last_read_event_id)
-                    >= int(resp_entries[0].message.id)
-                ):
-                    mark_read = True
-            except:
-                mark_read = True
+                while True:
+                    await slots.acquire()
+                    self.log.debug("Fetching with max_id %s", max_id)
+                    resp = await conv.fetch(max_id=max_id, priority=RequestPriority.BACKFILL)
+                    pages.put_nowait(resp)
+                    if (
+                        not resp.entries
+                        or resp.status == TimelineStatus.AT_END
+                        or resp.min_entry_id is None
+                        or resp.min_entry_id == max_id
+                    ):
+                        break
+                    max_id = resp.min_entry_id
+            except Exception as e:
+                pages.put_nowait(e)
+            else:
+                pages.put_nowait(None)
 
-            while True:
-                if resp_entries is None or len(resp_entries) == 0:
-                    break
-                for entry in resp_entries:
+        fetcher = asyncio.create_task(fetch_pages())
+        try:
+            while (resp := await pages.get()) is not None:
+                if isinstance(resp, Exception):
+                    raise resp
+                elif not resp.entries:
+                    return
+                page: list[MessageEntry | ReactionCreateEntry] = []
+                for entry in resp.entries:
                     if entry and entry.message:
-                        entries.append(entry.message)
-                        message_count += 1
+                        page.append(entry.message)
                         if entry.message.message_reactions:
-                            entries += entry.message.message_reactions
-                    if message_count >= limit:
-                        break
-                if message_count >= limit:
-                    self.log.debug("Got more messages than limit")
-                    break
+                            page += entry.message.message_reactions
+                yield resp, page
+                # The caller is done with the page, so another one can be fetched
+                slots.release()
+        finally:
+            fetcher.cancel()
+
+    @staticmethod
+    def _limit_backfill_page(
+        resp: FetchConversationResponse,
+        page: list[MessageEntry | ReactionCreateEntry],
+        remaining: int | None,
+    ) -> tuple[list[MessageEntry | ReactionCreateEntry], int, str | None]:
+        """
+        Cut a page of backfill entries (newest first) after ``remaining`` messages.
+
+        Returns:
+            The entries to bridge, the number of messages in them, and the ID to continue
+            fetching older messages from (``None`` if it's not known).
+        """
+        message_count = 0
+        last_message_id = None
+        for i, entry in enumerate(page):
+            if isinstance(entry, MessageEntry):
+                if remaining is not None and message_count >= remaining:
+                    # Continue from the oldest included message, not from the end of the page
+                    return page[:i], message_count, last_message_id
+                message_count += 1
+                last_message_id = entry.id
+        return page, message_count, resp.min_entry_id
+
+    def _should_mark_backfill_read(
+        self, resp: FetchConversationResponse, page: list[MessageEntry | ReactionCreateEntry]
+    ) -> bool:
+        try:
+            conv = resp.conversations[self.twid]
+            return datetime.now() - timedelta(days=30) > datetime.fromtimestamp(
+                conv.sort_timestamp
+            ) or (len(page) != 0 and int(conv.last_read_event_id) >= int(page[0].id))
+        except Exception:
+            return True
 
-                if resp.min_entry_id is None or resp.min_entry_id == max_id:
+    async def _fetch_backfill_entries(
+        self, source: u.User, limit: int | None, max_id: str | None = None
+    ) -> tuple[bool, list[MessageEntry | ReactionCreateEntry], str | None]:
+        entries: list[MessageEntry | ReactionCreateEntry] = []
+        message_count = 0
+        cursor = max_id
+        mark_read = None
+        self.log.debug("Fetching up to %s messages through %s", limit, source.twid)
+        # Nothing is done with the pages until all of them have been fetched, so prefetching
+        # would only waste requests after the limit is reached.
+        pages = self._iter_backfill_pages(source, max_id, prefetch=0)
+        try:
+            async for resp, page in pages:
+                if mark_read is None:
+                    mark_read = self._should_mark_backfill_read(resp, page)
+                page, page_messages, next_cursor = self._limit_backfill_page(
+                    resp, page, None if limit is None else limit - message_count
+                )
+                cursor = next_cursor or cursor
+                entries += page
+                message_count += page_messages
+                if limit is not None and message_count >= limit:
+                    self.log.debug("Got more messages than limit")
                     break
-                max_id = resp.min_entry_id
-                self.log.debug("Fetching more entries with max_id %s", max_id)
-                resp = await conv.fetch(max_id=max_id)
-
-            if len(entries) == 0:
-                return None, None
-            entries.sort(key=lambda ent: (ent.time, ent.id), reverse=True)
-            self.log.debug("Finished fetching entries")
-            return mark_read, entries
         except Exception:
             self.log.warning("Exception while fetching messages", exc_info=True)
-            return None, None
+            return None, None, None
+        finally:
+            await pages.aclose()
+        if len(entries) == 0:
+            return None, None, None
+        entries.sort(key=lambda ent: (ent.time, ent.id), reverse=True)
+        self.log.debug("Finished fetching entries")
+        return mark_read, entries, cursor
 
     async def _invite_own_puppet_backfill(self, source: u.User) -> set[IntentAPI]:
         backfill_leave = set()
@@ -1043,6 +1502,7 @@ class Portal(DBPortal, BasePortal):
         entries: list[MessageEntry | ReactionCreateEntry],
         is_forward: bool,
         mark_read: bool,
+        first_event: EventID | None = None,
     ) -> int:
         events = []
         twids = []
@@ -1139,13 +1599,13 @@ class Portal(DBPortal, BasePortal):
                     )
                 )
 
-        first_event = None
-        if not is_forward:
-            first_event = await DBMessage.get_first(self.mxid)
-            if first_event is None:
+        if is_forward:
+            first_event = None
+        elif first_event is None:
+            first_message = await DBMessage.get_first(self.mxid)
+            if first_message is None:
                 raise b.NoFirstMessageException
-            else:
-                first_event = first_event.mxid
+            first_event = first_message.mxid
         self.log.debug("Sending batch send request")
         resp = await intent.batch_send(
             self.mxid,
@@ -1168,21 +1628,26 @@ class Portal(DBPortal, BasePortal):
                 state_key=resp.base_insertion_event_id,
             )
 
+        messages = []
+        reactions = []
         for i, event_id in enumerate(resp.event_ids):
             if twids[i][1] == "message":
-                msg = DBMessage(event_id, self.mxid, twids[i][0], self.receiver)
-                await msg.upsert()
+                messages.append(DBMessage(event_id, self.mxid, twids[i][0], self.receiver))
             elif twids[i][1] == "reaction" and self.bridge.homeserver_software.is_hungry:
-                reaction = DBReaction(
-                    mxid=event_id,
-                    mx_room=self.mxid,
-                    tw_msgid=twids[i][2],
-                    tw_receiver=self.receiver,
-                    tw_sender=twids[i][3],
-                    reaction=twids[i][4],
-                    tw_reaction_id=twids[i][0],
+                reactions.append(
+                    DBReaction(
+                        mxid=event_id,
+                        mx_room=self.mxid,
+                        tw_msgid=twids[i][2],
+                        tw_receiver=self.receiver,
+                        tw_sender=twids[i][3],
+                        reaction=twids[i][4],
+                        tw_reaction_id=twids[i][0],
+                    )
                 )
-                await reaction.insert()
+        # Reactions reference messages, so the messages must be inserted first
+        await DBMessage.bulk_upsert(messages)
+        await DBReaction.bulk_insert(reactions)
         self.next_batch_id = resp.next_batch_id
         await self.update()
 
@@ -1354,7 +1819,7 @@ class Portal(DBPortal, BasePortal):
                 await self.main_intent.send_notice(self.mxid, msg)
 
             try:
-                await self._enqueue_backfills(source)
+                await self._enqueue_backfills(source, info)
             except Exception:
                 self.log.exception("Failed to backfill new portal")
 
@@ -1364,11 +1829,44 @@ class Portal(DBPortal, BasePortal):
 
         return self.mxid
 
-    async def _enqueue_backfills(self, source: u.User) -> None:
-        state = DBBackfillStatus(self.twid, self.receiver, source.twid, False, 0, 0)
+    async def _enqueue_backfills(self, source: u.User, info: Conversation) -> None:
+        state = DBBackfillStatus(
+            self.twid,
+            self.receiver,
+            source.twid,
+            0,
+            0,
+            last_activity=int(info.sort_timestamp.timestamp() * 1000),
+        )
         await state.insert()
         await b.BackfillStatus.recheck()
 
+    async def bump_backfill_priority(self) -> None:
+        """
+        Move the backfill of this portal to the front of the queue, because a Matrix user is
+        looking at the room. Bumps are throttled so that every read receipt doesn't hit the db.
+        """
+        now = time.monotonic()
+        if now - self._last_backfill_bump < self.backfill_bump_interval:
+            return
+        self._last_backfill_bump = now
+        try:
+            bumped = await DBBackfillStatus.bump(
+                self.twid,
+                self.receiver,
+                priority=DBBackfillStatus.PRIORITY_USER_ACTIVE,
+                last_activity=int(time.time() * 1000),
+            )
+        except Exception:
+            self.log.warning("Failed to bump backfill priority", exc_info=True)
+            return
+        if bumped:
+            self.log.debug("Bumped backfill priority after user activity")
+            await b.BackfillStatus.recheck()
+        else:
+            # The backfill is already finished (or was never queued), so don't try again
+            self._last_backfill_bump = float("inf")
+
     # endregion
     # region Database getters
 
@@ -17,6 +17,9 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterable, Awaitable, cast
 from os import path
+import asyncio
+import hashlib
+import time
 
 from aiohttp import ClientSession
 from yarl import URL
@@ -47,6 +50,13 @@ class Puppet(DBPuppet, BasePuppet):
     default_mxid_intent: IntentAPI
     default_mxid: UserID
 
+    _avatar_http: ClientSession | None = None
+    _avatar_lock: asyncio.Lock
+    # Avatars whose URL hasn't changed are re-checked with a conditional request after this many
+    # seconds, in case the image behind the URL was replaced.
+    avatar_refresh_interval: float = 24 * 60 * 60
+    _avatar_checked_at: float
+
     def __init__(
         self,
         twid: int,
@@ -59,6 +69,9 @@ class Puppet(DBPuppet, BasePuppet):
         next_batch: SyncToken | None = None,
         base_url: URL | None = None,
         contact_info_set: bool = False,
+        photo_hash: str | None = None,
+        photo_etag: str | None = None,
+        photo_last_modified: str | None = None,
     ) -> None:
         super().__init__(
             twid=twid,
@@ -71,8 +84,13 @@ class Puppet(DBPuppet, BasePuppet):
             next_batch=next_batch,
             base_url=base_url,
             contact_info_set=contact_info_set,
+            photo_hash=photo_hash,
+            photo_etag=photo_etag,
+            photo_last_modified=photo_last_modified,
         )
         self.log = self.log.getChild(str(twid))
+        self._avatar_lock = asyncio.Lock()
+        self._avatar_checked_at = time.monotonic()
 
         self.default_mxid = self.get_mxid_from_id(twid)
         self.default_mxid_intent = self.az.intent.user(self.default_mxid)
@@ -164,24 +182,76 @@ class Puppet(DBPuppet, BasePuppet):
         async for portal in p.Portal.find_private_chats_with(self.twid):
             await portal.update_name(self.name)
 
+    @classmethod
+    def _get_avatar_http(cls) -> ClientSession:
+        # A shared session lets avatar downloads reuse connections to the CDN
+        if cls._avatar_http is None or cls._avatar_http.closed:
+            cls._avatar_http = ClientSession()
+        return cls._avatar_http
+
+    @classmethod
+    async def close_avatar_http(cls) -> None:
+        if cls._avatar_http:
+            await cls._avatar_http.close()
+            cls._avatar_http = None
+
+    def _avatar_up_to_date(self, image_url: str) -> bool:
+        return (
+            image_url == self.photo_url
+            and time.monotonic() - self._avatar_checked_at < self.avatar_refresh_interval
+        )
+
     async def _update_avatar(self, image_url: str) -> bool:
-        if image_url != self.photo_url:
-            self.photo_url = image_url
-            url = URL(self.photo_url.replace("_normal.", "_400x400."))
-            file_name = path.basename(url.path)
-            async with ClientSession() as sess, sess.get(url) as resp:
-                content_type = resp.headers["Content-Type"]
-                resp_data = await resp.read()
-            mxc = await self.default_mxid_intent.upload_media(
-                data=resp_data,
-                filename=file_name,
-                mime_type=content_type,
-                async_upload=self.config["homeserver.async_media"],
-            )
-            self.photo_mxc = mxc
-            await self.default_mxid_intent.set_avatar_url(mxc)
+        if self._avatar_up_to_date(image_url):
+            return False
+        # Concurrent updates of the same puppet wait for the first one instead of downloading
+        # the same avatar again.
+        async with self._avatar_lock:
+            if self._avatar_up_to_date(image_url):
+                return False
+            return await self._reupload_avatar(image_url)
+
+    async def _reupload_avatar(self, image_url: str) -> bool:
+        url = URL(image_url.replace("_normal.", "_400x400."))
+        file_name = path.basename(url.path)
+        headers = {}
+        # The validators belong to the URL they were received from, so they're only sent when
+        # refreshing the current avatar. Sending them for a different URL could make the server
+        # say it's unchanged and keep the wrong avatar. A new URL is always downloaded, and the
+        # content hash below avoids reuploading identical images.
+        if self.photo_mxc and image_url == self.photo_url:
+            if self.photo_etag:
+                headers["If-None-Match"] = self.photo_etag
+            if self.photo_last_modified:
+                headers["If-Modified-Since"] = self.photo_last_modified
+        async with self._get_avatar_http().get(url, headers=headers) as resp:
+            if resp.status == 304:
+                self.log.debug(f"Avatar at {url} not modified, keeping {self.photo_mxc}")
+                self._avatar_checked_at = time.monotonic()
+                return False
+            resp.raise_for_status()
+            content_type = resp.headers["Content-Type"]
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            resp_data = await resp.read()
+        self._avatar_checked_at = time.monotonic()
+        self.photo_url = image_url
+        self.photo_etag = etag
+        self.photo_last_modified = last_modified
+        photo_hash = hashlib.sha256(resp_data).hexdigest()
+        if self.photo_mxc and photo_hash == self.photo_hash:
+            self.log.debug(f"Avatar at {url} has the same content, keeping {self.photo_mxc}")
             return True
-        return False
+        mxc = await self.default_mxid_intent.upload_media(
+            data=resp_data,
+            filename=file_name,
+            mime_type=content_type,
+            async_upload=self.config["homeserver.async_media"],
+        )
+        self.photo_mxc = mxc
+        self.photo_hash = photo_hash
+        await self.default_mxid_intent.set_avatar_url(mxc)
+        return True
 
     async def default_puppet_should_leave_room(self, room_id: RoomID) -> bool:
         portal = await p.Portal.get_by_mxid(room_id)
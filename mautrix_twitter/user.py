@@ -40,7 +40,14 @@ from mautrix.util.bridge_state import BridgeState, BridgeStateEvent
 from mautrix.util.opt_prometheus import Gauge, Summary, async_time
 from mautwitdm import TwitterAPI
 from mautwitdm.errors import TwitterAuthError, TwitterError
-from mautwitdm.poller import PollingErrored, PollingErrorResolved, PollingStarted, PollingStopped
+from mautwitdm.poller import (
+    PollingErrored,
+    PollingErrorResolved,
+    PollingStarted,
+    PollingStopped,
+    PollIntervalChanged,
+)
+from mautwitdm.scheduler import PollScheduler
 from mautwitdm.types import (
     Conversation,
     ConversationReadEntry,
@@ -66,6 +73,12 @@ METRIC_REACTION = Summary("bridge_on_reaction", "calls to handle_reaction")
 METRIC_RECEIPT = Summary("bridge_on_receipt", "calls to handle_receipt")
 METRIC_LOGGED_IN = Gauge("bridge_logged_in", "Users logged into the bridge")
 METRIC_CONNECTED = Gauge("bridge_connected", "Bridged users connected to Twitter")
+METRIC_DISPATCH_QUEUE = Gauge(
+    "bridge_dispatch_queue_depth", "Twitter events waiting to be handled", ["user"]
+)
+METRIC_POLL_INTERVAL = Gauge(
+    "bridge_poll_interval", "Current Twitter poll interval of users in seconds", ["user"]
+)
 
 BridgeState.human_readable_errors.update(
     {
@@ -133,6 +146,23 @@ class User(DBUser, BaseUser):
         cls.loop = bridge.loop
         TwitterAPI.error_sleep = cls.config["bridge.error_sleep"]
         TwitterAPI.max_poll_errors = cls.config["bridge.max_poll_errors"]
+        TwitterAPI.poll_sleep = cls.config["bridge.poll_interval.min"]
+        TwitterAPI.max_poll_sleep = cls.config["bridge.poll_interval.max"]
+        TwitterAPI.poll_sleep_step = cls.config["bridge.poll_interval.step"]
+        TwitterAPI.active_poll_window = cls.config["bridge.poll_interval.active_window"]
+        if cls.config["bridge.concurrent_dispatch.enabled"]:
+            TwitterAPI.concurrent_dispatch = True
+            TwitterAPI.max_concurrent_dispatch = cls.config["bridge.concurrent_dispatch.per_user"]
+            TwitterAPI.global_dispatch_semaphore = asyncio.Semaphore(
+                cls.config["bridge.concurrent_dispatch.global"]
+            )
+        if cls.config["bridge.poll_scheduler.enabled"]:
+            TwitterAPI.poll_scheduler = PollScheduler(
+                max_concurrent=cls.config["bridge.poll_scheduler.max_concurrent"],
+                jitter=cls.config["bridge.poll_scheduler.jitter"],
+                spacing=cls.config["bridge.poll_scheduler.spacing"],
+                log=logging.getLogger("mau.twitter.scheduler"),
+            )
         return (user.try_connect() async for user in cls.all_logged_in())
 
     async def update(self) -> None:
@@ -245,6 +275,10 @@ class User(DBUser, BaseUser):
         self.client.add_handler(PollingErrored, self.on_disconnect)
         self.client.add_handler(PollingErrored, self.on_error)
         self.client.add_handler(PollingErrorResolved, self.on_error_resolved)
+        self.client.add_handler(PollIntervalChanged, self.on_poll_interval_changed)
+        METRIC_DISPATCH_QUEUE.labels(user=self.mxid).set_function(
+            lambda: self.client.dispatch_queue_depth if self.client else 0
+        )
 
         user_info = await self._hacky_retry_loop(self.get_info, action="settings fetch")
         self.twid = user_info.id
@@ -373,6 +407,9 @@ class User(DBUser, BaseUser):
                 "Twitter polling error resolved", state_event=BridgeStateEvent.CONNECTED
             )
 
+    async def on_poll_interval_changed(self, evt: PollIntervalChanged) -> None:
+        METRIC_POLL_INTERVAL.labels(user=self.mxid).set(evt.interval)
+
     async def _try_sync_puppet(self, user_info: TwitterUser) -> None:
         puppet = await pu.Puppet.get_by_twid(self.twid)
         try:
@@ -413,32 +450,95 @@ class User(DBUser, BaseUser):
             self.poll_cursor = resp.cursor
         self.client.poll_cursor = self.poll_cursor
         self.log.debug("Fetching all trusted conversations...")
-        conversations, users = await self.client.all_trusted_conversations()
         limit = self.config["bridge.initial_conversation_sync"]
-        conversations = sorted(
-            conversations.values(), key=lambda conv: conv.sort_timestamp, reverse=True
+        self.log.info("Syncing trusted conversations (sync limit %d)", limit)
+        await self._sync_conversations(
+            self.client.iter_trusted_conversations(initial_state=resp), limit
         )
-        self.log.info("Got %d conversations (sync limit %d)", len(conversations), limit)
-        if limit < 0:
-            limit = len(conversations)
-        for _, user in users.items():
-            await self.handle_user_update(user)
-        index = 0
-        for conversation in conversations:
-            self.log.info(
-                "Syncing conversation %s (%d of %d)", conversation.conversation_id, index, limit
-            )
-            try:
-                create_portal = index < limit and conversation.trusted
-                if create_portal:
-                    index += 1
-                await self.handle_conversation_update(conversation, create_portal=create_portal)
-            except Exception:
-                self.log.exception(
-                    "Error while syncing conversation %s", conversation.conversation_id
-                )
         await self.update_direct_chats()
 
+    async def _sync_conversations(
+        self,
+        pages: AsyncIterable[tuple[dict[str, Conversation], dict[str, TwitterUser]]],
+        limit: int,
+    ) -> None:
+        puppet_semaphore = asyncio.Semaphore(self.config["bridge.sync_concurrency.puppets"])
+        puppet_updates: dict[str, asyncio.Task] = {}
+
+        async def update_puppet(user: TwitterUser) -> None:
+            async with puppet_semaphore:
+                try:
+                    await self.handle_user_update(user)
+                except Exception:
+                    self.log.exception("Error while syncing user %s", user.id)
+
+        # Pages are queued as soon as they arrive, so the workers can start creating the most
+        # recent rooms while older pages are still being fetched. The inbox is ordered by
+        # activity, so sorting each page keeps the queue in sort timestamp order.
+        queue: asyncio.Queue[tuple[Conversation, bool] | None] = asyncio.Queue()
+        # A conversation can show up on more than one page if it had activity while the inbox
+        # was being fetched, it's only handled (and counted towards the limit) the first time.
+        seen: set[str] = set()
+        created = 0
+        done = 0
+
+        async def fetch_pages() -> None:
+            nonlocal created
+            async for conversations, users in pages:
+                for user_id, user in users.items():
+                    if user_id not in puppet_updates:
+                        puppet_updates[user_id] = asyncio.create_task(update_puppet(user))
+                new = {
+                    conv_id: conv for conv_id, conv in conversations.items() if conv_id not in seen
+                }
+                seen.update(new)
+                conversations = sorted(
+                    new.values(), key=lambda conv: conv.sort_timestamp, reverse=True
+                )
+                for conversation in conversations:
+                    create_portal = (limit < 0 or created < limit) and conversation.trusted
+                    if create_portal:
+                        created += 1
+                    queue.put_nowait((conversation, create_portal))
+            self.log.info("Got %d conversations", len(seen))
+
+        async def sync_worker() -> None:
+            nonlocal done
+            while (item := await queue.get()) is not None:
+                conversation, create_portal = item
+                # Make sure the participants' puppets have their info before creating the room
+                await asyncio.gather(
+                    *(
+                        puppet_updates[participant.user_id]
+                        for participant in conversation.participants
+                        if participant.user_id in puppet_updates
+                    )
+                )
+                try:
+                    await self.handle_conversation_update(
+                        conversation, create_portal=create_portal
+                    )
+                except Exception:
+                    self.log.exception(
+                        "Error while syncing conversation %s", conversation.conversation_id
+                    )
+                done += 1
+                self.log.info(
+                    "Synced conversation %s (%d so far)", conversation.conversation_id, done
+                )
+
+        worker_count = max(self.config["bridge.sync_concurrency.conversations"], 1)
+        workers = [asyncio.create_task(sync_worker()) for _ in range(worker_count)]
+        try:
+            await fetch_pages()
+            for _ in workers:
+                queue.put_nowait(None)
+            await asyncio.gather(*workers)
+            await asyncio.gather(*puppet_updates.values())
+        finally:
+            for task in (*workers, *puppet_updates.values()):
+                task.cancel()
+
     async def tag_room(self, puppet: pu.Puppet, portal: po.Portal, tag: str, active: bool) -> None:
         if not tag or not portal or not portal.mxid:
             return
@@ -483,6 +583,7 @@ class User(DBUser, BaseUser):
         if self.client:
             self._intentional_stop = True
             self.client.stop_polling()
+            self.client.stop_processing_checks()
         self._track_metric(METRIC_CONNECTED, False)
         await self.update()
 
@@ -490,6 +591,7 @@ class User(DBUser, BaseUser):
         if self.client:
             self._intentional_stop = True
             self.client.stop_polling()
+            self.client.stop_processing_checks()
         self._track_metric(METRIC_CONNECTED, False)
         self._track_metric(METRIC_LOGGED_IN, False)
         puppet = await pu.Puppet.get_by_twid(self.twid, create=False)
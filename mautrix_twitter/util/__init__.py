@@ -1 +1,2 @@
 from .color_log import ColorFormatter
+from .media_worker import MediaWorkerPool
@@ -0,0 +1,202 @@
+# mautrix-twitter - A Matrix-Twitter DM puppeting bridge
+# Copyright (C) 2022 Tulir Asokan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Iterable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import binascii
+import struct
+import time
+
+from mautrix.errors import DecryptionError
+from mautrix.types import EncryptedFile
+from mautrix.util import ffmpeg
+from mautrix.util.opt_prometheus import Gauge, Summary
+
+try:
+    from mautrix.crypto.attachments import encrypt_attachment
+except ImportError:
+    encrypt_attachment = None
+
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Hash import SHA256
+    from Crypto.Util import Counter
+except ImportError:
+    try:
+        from Cryptodome.Cipher import AES
+        from Cryptodome.Hash import SHA256
+        from Cryptodome.Util import Counter
+    except ImportError:
+        AES = SHA256 = Counter = None
+
+try:
+    import unpaddedbase64
+except ImportError:
+    unpaddedbase64 = None
+
+T = TypeVar("T")
+
+METRIC_QUEUE_WAIT = Summary(
+    "bridge_media_worker_queue_wait", "Time media jobs spent waiting for a worker", ["kind"]
+)
+METRIC_RUN_TIME = Summary("bridge_media_worker_run", "Time spent running media jobs", ["kind"])
+METRIC_QUEUED = Gauge(
+    "bridge_media_worker_queued", "Media jobs that are queued or running", ["kind"]
+)
+
+
+class StreamDecryptor:
+    """
+    Decrypts an encrypted Matrix attachment chunk by chunk. The SHA-256 hash of the ciphertext is
+    only known after the last chunk, so :meth:`verify` must be called before the decrypted data
+    is used for anything permanent.
+    """
+
+    def __init__(self, file: EncryptedFile) -> None:
+        try:
+            key = unpaddedbase64.decode_base64(file.key.key)
+            iv = unpaddedbase64.decode_base64(file.iv)
+            self._expected_hash = unpaddedbase64.decode_base64(file.hashes["sha256"])
+        except (binascii.Error, TypeError, KeyError):
+            raise DecryptionError("Error decoding key, IV or hash")
+        if len(iv) != 16:
+            raise DecryptionError("Invalid IV length")
+        # Same as mautrix's decrypt_attachment, which also accepts non-zero IV counters
+        counter = Counter.new(64, prefix=iv[:8], initial_value=struct.unpack(">Q", iv[8:])[0])
+        try:
+            self._cipher = AES.new(key, AES.MODE_CTR, counter=counter)
+        except ValueError as e:
+            raise DecryptionError("Failed to create AES cipher") from e
+        self._hash = SHA256.new()
+
+    def update(self, chunk: bytes | bytearray) -> bytes:
+        self._hash.update(chunk)
+        return self._cipher.decrypt(chunk)
+
+    def verify(self) -> None:
+        if self._hash.digest() != self._expected_hash:
+            raise DecryptionError("Mismatched SHA-256 digest")
+
+
+class MediaWorkerPool:
+    """
+    Runs CPU-heavy media work (attachment encryption and decryption, ffmpeg conversions) outside
+    the event loop, so that large files don't stall polling and message delivery for everyone.
+
+    Encryption and decryption run in a thread pool, as the AES and SHA-256 implementations
+    release the GIL. ffmpeg already runs as a subprocess, so conversions are only limited to a
+    number of concurrent processes. When all workers are busy and ``max_queued`` jobs are already
+    waiting, callers wait before their job is queued, which applies backpressure to the message
+    handlers instead of buffering an unbounded number of files in memory.
+    """
+
+    # Streamed decryption is done in batches of at least this many bytes, as handing every small
+    # chunk to a thread would cost about as much as decrypting it.
+    stream_batch_size: int = 1024 * 1024
+
+    _executor: ThreadPoolExecutor
+    _thread_slots: asyncio.Semaphore
+    _ffmpeg_slots: asyncio.Semaphore
+
+    def __init__(self, threads: int = 4, max_queued: int = 32, ffmpeg_processes: int = 2) -> None:
+        threads = max(threads, 1)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="media")
+        self._thread_slots = asyncio.Semaphore(threads + max(max_queued, 0))
+        self._ffmpeg_slots = asyncio.Semaphore(max(ffmpeg_processes, 1))
+
+    async def run(self, kind: str, func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking function in the worker thread pool.
+
+        Args:
+            kind: The type of the job, used as the label of the metrics.
+            func: The function to run.
+            *args: The arguments to pass to the function.
+
+        Returns:
+            The return value of the function.
+        """
+        queued_at = time.monotonic()
+        started_at: float | None = None
+
+        def timed() -> T:
+            nonlocal started_at
+            started_at = time.monotonic()
+            return func(*args)
+
+        METRIC_QUEUED.labels(kind=kind).inc()
+        try:
+            async with self._thread_slots:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            METRIC_QUEUED.labels(kind=kind).dec()
+            # Jobs that were cancelled before a worker picked them up aren't measured
+            if started_at is not None:
+                METRIC_QUEUE_WAIT.labels(kind=kind).observe(started_at - queued_at)
+                METRIC_RUN_TIME.labels(kind=kind).observe(time.monotonic() - started_at)
+
+    async def encrypt(self, data: bytes) -> tuple[bytes, EncryptedFile]:
+        return await self.run("encrypt", encrypt_attachment, data)
+
+    async def decrypt_stream(
+        self, data: AsyncIterable[bytes], file: EncryptedFile
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Decrypt an encrypted attachment as it's being downloaded.
+
+        The hash is checked after the last chunk, so a consumer that reads the whole stream
+        (like an upload before it's finalized) gets a :class:`DecryptionError` if the file
+        was tampered with.
+        """
+        decryptor = StreamDecryptor(file)
+        batch = bytearray()
+        async for chunk in data:
+            batch += chunk
+            if len(batch) >= self.stream_batch_size:
+                yield await self.run("decrypt", decryptor.update, batch)
+                batch = bytearray()
+        # The rest is smaller than a batch, so it's cheaper to decrypt it right here
+        if batch:
+            yield decryptor.update(batch)
+        decryptor.verify()
+
+    async def convert_bytes(
+        self,
+        data: bytes,
+        output_extension: str,
+        output_args: Iterable[str] | None = None,
+        input_mime: str | None = None,
+    ) -> bytes:
+        """
+        Convert a media file with ffmpeg, limiting the number of concurrent ffmpeg processes.
+        See :func:`mautrix.util.ffmpeg.convert_bytes` for the arguments.
+        """
+        queued_at = time.monotonic()
+        METRIC_QUEUED.labels(kind="ffmpeg").inc()
+        try:
+            async with self._ffmpeg_slots:
+                started_at = time.monotonic()
+                METRIC_QUEUE_WAIT.labels(kind="ffmpeg").observe(started_at - queued_at)
+                try:
+                    return await ffmpeg.convert_bytes(
+                        data, output_extension, output_args=output_args, input_mime=input_mime
+                    )
+                finally:
+                    METRIC_RUN_TIME.labels(kind="ffmpeg").observe(time.monotonic() - started_at)
+        finally:
+            METRIC_QUEUED.labels(kind="ffmpeg").dec()
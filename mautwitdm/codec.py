@@ -0,0 +1,47 @@
+# Copyright (c) 2022 Tulir Asokan
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+"""
+The JSON codec used for Twitter requests and responses. The fastest available library is picked
+when the module is imported: orjson if it's installed, then ujson, and the standard library json
+module otherwise.
+"""
+from __future__ import annotations
+
+from typing import Any
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson:
+    name = "orjson"
+    loads = orjson.loads
+
+    def dumps(data: Any) -> str:
+        return orjson.dumps(data).decode("utf-8")
+
+    # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+    DecodeError: tuple[type[Exception], ...] = (json.JSONDecodeError,)
+elif ujson:
+    name = "ujson"
+    loads = ujson.loads
+    dumps = ujson.dumps
+    # ujson.JSONDecodeError only exists in recent versions, older ones raise a plain ValueError
+    DecodeError: tuple[type[Exception], ...] = (ValueError,)
+else:
+    name = "json"
+    loads = json.loads
+    dumps = json.dumps
+    DecodeError: tuple[type[Exception], ...] = (json.JSONDecodeError,)
+
+__all__ = ["name", "loads", "dumps", "DecodeError"]
@@ -11,6 +11,7 @@ from yarl import URL
 
 from . import twitter as tw
 from .errors import check_error
+from .ratelimit import RequestPriority
 from .types import FetchConversationResponse, ReactionKey, SendResponse
 
 
@@ -85,6 +86,7 @@ class Conversation:
             data["media_id"] = str(media_id)
             if voice_message:
                 data["audio_only_media_attachment"] = True
+        self.api.note_activity()
         async with self.api.http.post(url, json=data, headers=self.api.headers) as resp:
             resp_data = await check_error(resp)
             return SendResponse.deserialize(resp_data)
@@ -138,12 +140,16 @@ class Conversation:
         async with self.api.http.post(url, headers=self.api.headers) as resp:
             await check_error(resp)
 
-    async def fetch(self, max_id: str | None = None) -> FetchConversationResponse:
+    async def fetch(
+        self, max_id: str | None = None, priority: RequestPriority = RequestPriority.LIVE
+    ) -> FetchConversationResponse:
         """
         Fetch the conversation metadata and message history.
 
         Args:
             max_id: The maximum message ID to fetch.
+            priority: The priority of the request in the rate limit budget. Backfilling should use
+                :attr:`RequestPriority.BACKFILL` to leave room for live requests.
 
         Returns:
             The requested metadata and message history.
@@ -156,8 +162,9 @@ class Conversation:
         req = (self.api.dm_url / "conversation" / f"{self.id}.json").with_query(query)
         if max_id:
             req = req.update_query({"max_id": max_id})
+        await self.api.rate_limits.acquire("conversation", priority)
         async with self.api.http.get(req, headers=self.api.headers) as resp:
-            resp_data = await check_error(resp)
+            resp_data = await self.api.rate_limits.check("conversation", resp)
         data = resp_data["conversation_timeline"]
         if "entries" not in data:
             data["entries"] = None
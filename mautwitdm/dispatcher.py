@@ -5,9 +5,10 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import Any, Awaitable, Callable, TypeVar
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+import asyncio
 
-from mautrix.util.logging import TraceLogger
+from mautrix.util.logging import TRACE, TraceLogger
 
 T = TypeVar("T")
 Handler = Callable[[T], Awaitable[Any]]
@@ -21,6 +22,39 @@ class TwitterDispatcher:
 
     log: TraceLogger
     _handlers: dict[type[T], list[Handler]]
+    _handler_cache: dict[type[T], tuple[Handler, ...]]
+
+    concurrent_dispatch: bool = False
+    max_concurrent_dispatch: int = 8
+    dispatch_idle_timeout: int = 60
+    dispatch_queue_size: int = 256
+    global_dispatch_semaphore: asyncio.Semaphore | None = None
+    _dispatch_semaphore: asyncio.Semaphore
+    _dispatch_queues: dict[str, asyncio.Queue]
+    _dispatch_workers: dict[str, asyncio.Task]
+
+    def _get_handlers(self, event_type: type[T]) -> tuple[Handler, ...]:
+        try:
+            return self._handler_cache[event_type]
+        except KeyError:
+            pass
+        # Resolve handlers registered for the type itself and any of its base classes
+        handlers = tuple(
+            handler
+            for base_type in event_type.__mro__
+            for handler in self._handlers.get(base_type, ())
+        )
+        self._handler_cache[event_type] = handlers
+        return handlers
+
+    async def _dispatch(self, event: T, handlers: tuple[Handler, ...]) -> None:
+        if self.log.isEnabledFor(TRACE):
+            self.log.trace("Dispatching %s", event)
+        for handler in handlers:
+            try:
+                await handler(event)
+            except Exception:
+                self.log.exception(f"Error while handling event of type {type(event)}")
 
     async def dispatch(self, event: T) -> None:
         """
@@ -29,22 +63,34 @@ class TwitterDispatcher:
         Args:
             event: The event to dispatch.
         """
-        self.log.trace("Dispatching %s", event)
-        for handler in self._handlers[type(event)]:
-            try:
-                await handler(event)
-            except Exception:
-                self.log.exception(f"Error while handling event of type {type(event)}")
+        handlers = self._get_handlers(type(event))
+        if handlers:
+            await self._dispatch(event, handlers)
+
+    async def dispatch_many(self, events: Iterable[T]) -> None:
+        """
+        Dispatch multiple events in order. Events of types that don't have any handlers are
+        skipped without any other processing.
+
+        Args:
+            events: The events to dispatch.
+        """
+        get_handlers = self._get_handlers
+        for event in events:
+            handlers = get_handlers(type(event))
+            if handlers:
+                await self._dispatch(event, handlers)
 
     def add_handler(self, event_type: type[T], handler: Handler) -> None:
         """
-        Add an event handler.
+        Add an event handler. The handler will also receive events of subclasses of the type.
 
         Args:
             event_type: The type of event to handle.
             handler: The handler function.
         """
         self._handlers[event_type].append(handler)
+        self._handler_cache.clear()
 
     def remove_handler(self, event_type: type[T], handler: Handler) -> None:
         """
@@ -55,3 +101,54 @@ class TwitterDispatcher:
             handler: The handler function to remove.
         """
         self._handlers[event_type].remove(handler)
+        self._handler_cache.clear()
+
+    @property
+    def dispatch_queue_depth(self) -> int:
+        """The total number of events waiting in :meth:`dispatch_ordered` queues."""
+        return sum(queue.qsize() for queue in self._dispatch_queues.values())
+
+    async def dispatch_ordered(self, key: str, event: T) -> None:
+        """
+        Dispatch an event in the background. Events with the same key are handled one by one in
+        the order they were passed to this method, while events with different keys are handled
+        concurrently (up to :attr:`max_concurrent_dispatch` per account and
+        :attr:`global_dispatch_semaphore` in total).
+
+        If the queue of the key is full, this will wait until there's room in the queue.
+
+        Args:
+            key: The ordering key, e.g. a conversation ID.
+            event: The event to dispatch.
+        """
+        try:
+            queue = self._dispatch_queues[key]
+        except KeyError:
+            queue = self._dispatch_queues[key] = asyncio.Queue(self.dispatch_queue_size)
+            self._dispatch_workers[key] = asyncio.create_task(self._dispatch_worker(key, queue))
+        await queue.put(event)
+
+    async def _dispatch_worker(self, key: str, queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), self.dispatch_idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    del self._dispatch_queues[key]
+                    del self._dispatch_workers[key]
+                    return
+                continue
+            async with self._dispatch_semaphore:
+                if self.global_dispatch_semaphore:
+                    async with self.global_dispatch_semaphore:
+                        await self.dispatch(event)
+                else:
+                    await self.dispatch(event)
+            queue.task_done()
+
+    def stop_dispatching(self) -> None:
+        """Cancel all background dispatch workers and drop any queued events."""
+        for task in self._dispatch_workers.values():
+            task.cancel()
+        self._dispatch_workers = {}
+        self._dispatch_queues = {}
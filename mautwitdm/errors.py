@@ -4,12 +4,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from typing import Any
-import json
 import time
 
 from aiohttp import ClientResponse, ContentTypeError
 from multidict import CIMultiDictProxy
 
+from . import codec
+
 
 class TwitterError(Exception):
     code: int
@@ -51,11 +52,11 @@ class UnsupportedAttachmentError(NotImplementedError):
 
 async def check_error(resp: ClientResponse) -> Any:
     try:
-        resp_data = await resp.json()
+        resp_data = await resp.json(loads=codec.loads)
     except ContentTypeError:
         resp.raise_for_status()
         return
-    except json.JSONDecodeError:
+    except codec.DecodeError:
         resp.raise_for_status()
         raise
 
@@ -5,7 +5,7 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import Dict
+from typing import Any, AsyncIterator, Dict
 import asyncio
 import logging
 import time
@@ -16,7 +16,9 @@ from yarl import URL
 
 from . import conversation as c
 from .dispatcher import TwitterDispatcher
-from .errors import RateLimitError, TwitterAuthError, check_error
+from .errors import RateLimitError, TwitterAuthError
+from .ratelimit import RateLimitBudget
+from .scheduler import PollScheduler
 from .types import (
     Conversation,
     InboxTimeline,
@@ -46,6 +48,11 @@ class PollingErrorResolved:
     pass
 
 
+@dataclass
+class PollIntervalChanged:
+    interval: float
+
+
 class TwitterPoller(TwitterDispatcher):
     """This class handles polling for new messages using ``/dm/user_updates.json``."""
 
@@ -58,13 +65,42 @@ class TwitterPoller(TwitterDispatcher):
     skip_poll_wait: asyncio.Event
 
     poll_sleep: int = 3
+    max_poll_sleep: int = 30
+    poll_sleep_step: float = 1.5
+    active_poll_window: int = 60
     error_sleep: int = 5
     max_poll_errors: int = 12
     max_poll_auth_errors: int = 4
+    poll_scheduler: PollScheduler | None = None
     poll_cursor: str | None
+    poll_interval: float
     dispatch_initial_resp: bool
     _poll_task: asyncio.Task | None
     _typing_in: c.Conversation | None
+    rate_limits: RateLimitBudget
+    _last_activity: float
+
+    def note_activity(self) -> None:
+        """
+        Mark the account as active. This resets the poll interval to :attr:`poll_sleep` and wakes
+        up the poller if it was waiting for a longer idle interval.
+        """
+        self._last_activity = time.monotonic()
+        if self.poll_interval > self.poll_sleep:
+            self.poll_interval = max(self.poll_sleep, self.rate_limits.bucket("poll").pace)
+            self.skip_poll_wait.set()
+            if self.poll_scheduler:
+                self.poll_scheduler.expedite(self)
+
+    def _next_poll_interval(self, resp: PollResponse | InitialStateResponse) -> float:
+        if any(entry and entry.message for entry in resp.entries or []):
+            self._last_activity = time.monotonic()
+        if time.monotonic() - self._last_activity < self.active_poll_window:
+            interval = self.poll_sleep
+        else:
+            interval = min(self.poll_interval * self.poll_sleep_step, self.max_poll_sleep)
+        # Spread the remaining requests evenly over the rest of the rate limit window
+        return max(interval, self.rate_limits.bucket("poll").pace)
 
     @property
     def poll_query_params(self) -> dict[str, str]:
@@ -126,41 +162,56 @@ class TwitterPoller(TwitterDispatcher):
             **self.poll_params,
         }
 
-    async def all_trusted_conversations(
-        self,
-    ) -> tuple[Dict[str, Conversation], Dict[str, User]]:
+    async def iter_trusted_conversations(
+        self, initial_state: InitialStateResponse | None = None
+    ) -> AsyncIterator[tuple[Dict[str, Conversation], Dict[str, User]]]:
         """
-        Get all trusted conversations from the inbox (using pagination).
+        Iterate over the trusted conversations in the inbox page by page. The inbox is ordered by
+        activity, so the most recently active conversations are yielded first, and callers can
+        start handling them while the rest of the pages are still being fetched.
 
-        Returns:
-            Dictionary containing all conversations, keyed by their ID.
+        Args:
+            initial_state: An already fetched initial state response to use as the first page.
+                If not provided, it will be fetched (without changing :attr:`poll_cursor`).
+
+        Yields:
+            Tuples of the conversations and users in each page, keyed by their ID.
         """
-        initial_state = await self.inbox_initial_state(set_poll_cursor=False)
-        conversations = initial_state.conversations
-        users = initial_state.users
+        if initial_state is None:
+            initial_state = await self.inbox_initial_state(set_poll_cursor=False)
+        yield initial_state.conversations, initial_state.users
 
         if initial_state.inbox_timelines.trusted.status == TimelineStatus.AT_END:
-            return conversations, users
+            return
 
         min_entry_id = initial_state.inbox_timelines.trusted.min_entry_id
 
-        while True:
+        while min_entry_id is not None:
             self.log.debug("Not at end, fetching more conversations with max_id %s", min_entry_id)
             inbox_timeline = await self.inbox_timeline("trusted", min_entry_id)
+            yield inbox_timeline.conversations or {}, inbox_timeline.users or {}
+            if inbox_timeline.status == TimelineStatus.AT_END:
+                return
+            min_entry_id = inbox_timeline.min_entry_id
 
-            if inbox_timeline.conversations is not None:
-                conversations = {**conversations, **inbox_timeline.conversations}
-
-            if inbox_timeline.users is not None:
-                users = {**users, **inbox_timeline.users}
+    async def all_trusted_conversations(
+        self, initial_state: InitialStateResponse | None = None
+    ) -> tuple[Dict[str, Conversation], Dict[str, User]]:
+        """
+        Get all trusted conversations from the inbox (using pagination).
 
-            if inbox_timeline.status == TimelineStatus.AT_END:
-                return conversations, users
+        Args:
+            initial_state: An already fetched initial state response to use as the first page.
 
-            if inbox_timeline.min_entry_id is not None:
-                min_entry_id = inbox_timeline.min_entry_id
-            else:
-                return conversations, users
+        Returns:
+            Dictionary containing all conversations, keyed by their ID.
+        """
+        conversations: Dict[str, Conversation] = {}
+        users: Dict[str, User] = {}
+        async for page_conversations, page_users in self.iter_trusted_conversations(initial_state):
+            conversations.update(page_conversations)
+            users.update(page_users)
+        return conversations, users
 
     async def inbox_timeline(self, inbox: str, max_id: str) -> InboxTimeline:
         """
@@ -172,8 +223,9 @@ class TwitterPoller(TwitterDispatcher):
         url = (self.dm_url / "inbox_timeline" / f"{inbox}.json").with_query(
             {**self.full_state_params, "max_id": max_id}
         )
+        await self.rate_limits.acquire("inbox")
         async with self.http.get(url, headers=self.headers) as resp:
-            data = await check_error(resp)
+            data = await self.rate_limits.check("inbox", resp)
             response = InboxTimeline.deserialize(data["inbox_timeline"])
             return response
 
@@ -193,8 +245,9 @@ class TwitterPoller(TwitterDispatcher):
                 "include_quality": "all",
             }
         )
+        await self.rate_limits.acquire("inbox")
         async with self.http.get(url, headers=self.headers) as resp:
-            data = await check_error(resp)
+            data = await self.rate_limits.check("inbox", resp)
             response = InitialStateResponse.deserialize(data["inbox_initial_state"])
             if set_poll_cursor:
                 self.poll_cursor = response.cursor
@@ -212,7 +265,7 @@ class TwitterPoller(TwitterDispatcher):
             }
         )
         async with self.http.get(url, headers=self.headers) as resp:
-            data = await check_error(resp)
+            data = await self.rate_limits.check("poll", resp)
             try:
                 user_events = data["user_events"]
             except KeyError:
@@ -249,12 +302,31 @@ class TwitterPoller(TwitterDispatcher):
             self.log.exception("Fatal error while polling")
             if raise_exceptions:
                 raise
+        finally:
+            # Don't unregister if this task was already replaced by a new one in start_polling
+            if self.poll_scheduler and self._poll_task in (asyncio.current_task(), None):
+                self.poll_scheduler.unregister(self)
+
+    async def _dispatch_in_conversation(self, conversation_id: str, event: Any) -> None:
+        if self.concurrent_dispatch:
+            await self.dispatch_ordered(conversation_id, event)
+        else:
+            await self.dispatch(event)
 
     async def dispatch_all(self, resp: PollResponse | InitialStateResponse) -> None:
-        for user in (resp.users or {}).values():
-            await self.dispatch(user)
-        for conversation in (resp.conversations or {}).values():
-            await self.dispatch(conversation)
+        """
+        Dispatch all users, conversations and entries in a poll response.
+
+        If :attr:`concurrent_dispatch` is enabled, users are still dispatched right away, but
+        conversations and entries are queued with :meth:`dispatch_ordered`, so that each
+        conversation is handled in order while different conversations are handled concurrently.
+        """
+        await self.dispatch_many((resp.users or {}).values())
+        if self.concurrent_dispatch:
+            for conversation in (resp.conversations or {}).values():
+                await self.dispatch_ordered(conversation.conversation_id, conversation)
+        else:
+            await self.dispatch_many((resp.conversations or {}).values())
         for entry in resp.entries or []:
             if not entry:
                 continue
@@ -269,13 +341,36 @@ class TwitterPoller(TwitterDispatcher):
                     )
                     if entry_type.conversation:
                         self.log.debug(f"{msg}, but the entry had its own conversation info")
-                        await self.dispatch(entry_type)
+                        await self._dispatch_in_conversation(
+                            entry_type.conversation_id, entry_type
+                        )
                     else:
                         # TODO we could still dispatch the event and guess the conversation type
                         #      in event handlers if necessary.
                         self.log.warning(msg)
                 else:
-                    await self.dispatch(entry_type)
+                    await self._dispatch_in_conversation(entry_type.conversation_id, entry_type)
+
+    async def _wait_and_poll(self, delay: float, after_success: bool) -> PollResponse:
+        # Wait for rate limit budget before taking a turn, so that a scheduler slot isn't held
+        # while waiting for the rate limit to reset.
+        await self.rate_limits.acquire("poll")
+        if self.poll_scheduler:
+            async with self.poll_scheduler.turn(self, delay):
+                if after_success and self._typing_in:
+                    await self._typing_in.mark_typing()
+                return await self._poll_once()
+        if after_success:
+            try:
+                await asyncio.wait_for(self.skip_poll_wait.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self.skip_poll_wait.clear()
+            if self._typing_in:
+                await self._typing_in.mark_typing()
+        else:
+            await asyncio.sleep(delay)
+        return await self._poll_once()
 
     async def _poll_forever(self) -> None:
         if not self.poll_cursor:
@@ -285,18 +380,20 @@ class TwitterPoller(TwitterDispatcher):
                 await self.dispatch_all(resp)
         await self.dispatch(PollingStarted())
         errors = 0
+        delay = 0
+        after_success = False
         while True:
             try:
-                resp = await self._poll_once()
+                resp = await self._wait_and_poll(delay, after_success)
             except RateLimitError as e:
-                sleep = e.reset - int(time.time())
+                # The poll budget was marked as empty, so acquiring it before the next poll
+                # already waits until the limit resets.
+                delay = 0
+                after_success = False
                 self.log.warning(
-                    f"Got rate limit until {e.reset} while polling, waiting {sleep} seconds"
+                    f"Got rate limit until {e.reset} while polling, "
+                    f"waiting {e.reset - int(time.time())} seconds"
                 )
-                if self.poll_sleep < 8:
-                    self.poll_sleep += 1
-                    self.log.debug(f"Increased poll sleep to {self.poll_sleep}")
-                await asyncio.sleep(sleep)
                 continue
             except Exception as e:
                 max_errors = (
@@ -310,21 +407,20 @@ class TwitterPoller(TwitterDispatcher):
                     )
                     raise
                 errors += 1
-                sleep = min(15 * 60, self.error_sleep * errors)
-                self.log.warning(f"Error while polling, retrying in {sleep}s", exc_info=True)
+                delay = min(15 * 60, self.error_sleep * errors)
+                after_success = False
+                self.log.warning(f"Error while polling, retrying in {delay}s", exc_info=True)
                 await self.dispatch(PollingErrored(e, fatal=False, count=errors))
-                await asyncio.sleep(sleep)
                 continue
             if errors > 0:
                 errors = 0
                 await self.dispatch(PollingErrorResolved())
             await self.dispatch_all(resp)
-            try:
-                await asyncio.wait_for(self.skip_poll_wait.wait(), self.poll_sleep)
-            except asyncio.TimeoutError:
-                pass
-            if self._typing_in:
-                await self._typing_in.mark_typing()
+            delay = self._next_poll_interval(resp)
+            if delay != self.poll_interval:
+                self.poll_interval = delay
+                await self.dispatch(PollIntervalChanged(delay))
+            after_success = True
 
     def is_polling(self) -> bool:
         return self._poll_task and not self._poll_task.done()
@@ -334,11 +430,16 @@ class TwitterPoller(TwitterDispatcher):
         Start polling forever in the background. This calls :meth:`poll_forever` and puts it in an
         asyncio Task. The task is stored so it can be cancelled with :meth:`stop_polling`.
 
+        If :attr:`poll_scheduler` is set, the poller is registered with it and the task will wait
+        for turns from the shared scheduler instead of sleeping on its own.
+
         Returns:
             The created asyncio task.
         """
         self.stop_polling()
         self.log.debug("Starting poll task")
+        if self.poll_scheduler:
+            self.poll_scheduler.register(self)
         self._poll_task = asyncio.create_task(self.poll_forever())
         return self._poll_task
 
@@ -348,3 +449,6 @@ class TwitterPoller(TwitterDispatcher):
             self.log.debug("Cancelling ongoing poll task")
             self._poll_task.cancel()
             self._poll_task = None
+        self.stop_dispatching()
+        if self.poll_scheduler:
+            self.poll_scheduler.unregister(self)
@@ -0,0 +1,166 @@
+# Copyright (c) 2022 Tulir Asokan
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from .errors import UnsupportedAttachmentError
+from .types import MediaUploadResponse
+
+
+class ProcessingTracker:
+    """
+    Waits for Twitter to finish processing uploaded media.
+
+    All uploads of an account share one tracker, which keeps the next status check of each upload
+    in a single timer heap. Checks are only done when ``check_after_secs`` of an upload has
+    passed, checks that are due at the same time are sent together, and the waiting uploads are
+    resolved through futures instead of each running its own polling loop. Each check runs in
+    its own task, so a check that waits for the rate limit doesn't hold up the other uploads.
+    """
+
+    log: logging.Logger
+
+    _check: Callable[[str], Awaitable[dict[str, Any]]]
+    _heap: list[tuple[float, int, str]]
+    _waiters: dict[str, asyncio.Future]
+    _counter: itertools.count
+    _wakeup: asyncio.Event
+    _task: asyncio.Task | None
+    _checks: dict[str, asyncio.Task]
+
+    def __init__(
+        self, check: Callable[[str], Awaitable[dict[str, Any]]], log: logging.Logger
+    ) -> None:
+        """
+        Args:
+            check: A function that requests the processing status of an upload.
+            log: The logger to use.
+        """
+        self.log = log
+        self._check = check
+        self._heap = []
+        self._waiters = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._checks = {}
+
+    async def wait(
+        self, media_id: str, check_after: float = 1, timeout: float | None = None
+    ) -> MediaUploadResponse:
+        """
+        Wait until Twitter has finished processing an upload.
+
+        Args:
+            media_id: The ID of the upload.
+            check_after: Number of seconds after which the status should be checked first.
+            timeout: Maximum number of seconds to wait.
+
+        Returns:
+            The status of the upload after processing succeeded.
+
+        Raises:
+            asyncio.TimeoutError: If processing didn't finish within the timeout.
+            UnsupportedAttachmentError: If Twitter failed to process the media.
+        """
+        fut = self._waiters.get(media_id)
+        if fut is None:
+            fut = self._waiters[media_id] = asyncio.get_running_loop().create_future()
+            self._schedule(media_id, check_after)
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout)
+        finally:
+            # If the wait timed out or was cancelled, stop checking the status
+            if not fut.done():
+                fut.cancel()
+            if self._waiters.get(media_id) is fut:
+                del self._waiters[media_id]
+
+    def _schedule(self, media_id: str, check_after: float) -> None:
+        due = time.monotonic() + check_after
+        if not self._heap or due < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (due, next(self._counter), media_id))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while self._heap:
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                # Re-check the heap, something may have been scheduled earlier
+                continue
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, media_id = heapq.heappop(self._heap)
+                # A check that is already running reschedules the upload itself if necessary
+                if media_id in self._waiters and media_id not in self._checks:
+                    self._start_check(media_id)
+
+    def _start_check(self, media_id: str) -> None:
+        task = self._checks[media_id] = asyncio.create_task(self._check_status(media_id))
+
+        def done(_: asyncio.Task) -> None:
+            if self._checks.get(media_id) is task:
+                del self._checks[media_id]
+
+        task.add_done_callback(done)
+
+    def stop(self) -> None:
+        """Stop checking the status of uploads and cancel everything that's waiting."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in self._checks.values():
+            task.cancel()
+        self._checks = {}
+        self._heap = []
+        for fut in self._waiters.values():
+            fut.cancel()
+
+    async def _check_status(self, media_id: str) -> None:
+        fut = self._waiters.get(media_id)
+        if fut is None or fut.done():
+            return
+        try:
+            data = await self._check(media_id)
+            info = data["processing_info"]
+            state = info["state"]
+            if state == "succeeded":
+                self.log.debug(f"Server completed processing of {media_id}")
+                result = MediaUploadResponse.deserialize(data)
+            elif state in ("pending", "in_progress"):
+                check_after = info.get("check_after_secs", 1)
+                self.log.debug(
+                    f"Upload of {media_id} at {info.get('progress_percent', 0)} %, "
+                    f"re-checking after {check_after} seconds"
+                )
+                self._schedule(media_id, check_after)
+                return
+            elif state == "failed":
+                error = info.get("error", {})
+                raise UnsupportedAttachmentError(
+                    f"Twitter failed to process media: {error.get('message', 'unknown error')}"
+                )
+            else:
+                raise RuntimeError(f"Unknown state {state}")
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+        else:
+            if not fut.done():
+                fut.set_result(result)
@@ -0,0 +1,148 @@
+# Copyright (c) 2022 Tulir Asokan
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from typing import Any
+from enum import IntEnum
+import asyncio
+import math
+import time
+
+from aiohttp import ClientResponse
+from multidict import CIMultiDictProxy
+
+from .errors import RateLimitError, check_error
+
+
+class RequestPriority(IntEnum):
+    LIVE = 0
+    BACKFILL = 1
+
+
+class RateLimitBucket:
+    """
+    Tracks the request budget of a single endpoint family, based on the ``x-rate-limit-*``
+    headers that Twitter includes in responses.
+    """
+
+    window: int = 15 * 60
+
+    limit: int | None
+    remaining: int | None
+    reset: float
+
+    def __init__(self) -> None:
+        self.limit = None
+        self.remaining = None
+        self.reset = 0
+
+    def update(self, headers: CIMultiDictProxy[str]) -> None:
+        try:
+            limit = int(headers["x-rate-limit-limit"])
+            remaining = int(headers["x-rate-limit-remaining"])
+            reset = int(headers["x-rate-limit-reset"])
+        except (KeyError, ValueError):
+            return
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+
+    def exhaust(self, reset: int) -> None:
+        """Mark the bucket as empty until the given timestamp, e.g. after a rate limit error."""
+        self.remaining = 0
+        self.reset = reset
+
+    @property
+    def pace(self) -> float:
+        """The number of seconds to wait between requests to use the budget evenly."""
+        if self.remaining is None:
+            return 0
+        return max(self.reset - time.time(), 0) / max(self.remaining, 1)
+
+    def _reserve(self, priority: RequestPriority, reserve: float) -> int:
+        if priority == RequestPriority.LIVE or not self.limit:
+            return 0
+        return math.ceil(self.limit * reserve)
+
+    async def acquire(self, priority: RequestPriority, reserve: float) -> None:
+        while True:
+            now = time.time()
+            if self.remaining is None:
+                return
+            elif now >= self.reset:
+                # The window has passed, assume a full budget until the server tells otherwise
+                self.remaining = (self.limit or 1) - 1
+                self.reset = now + self.window
+                return
+            elif self.remaining > self._reserve(priority, reserve):
+                self.remaining -= 1
+                return
+            await asyncio.sleep(self.reset - now + 1)
+
+
+class RateLimitBudget:
+    """
+    Keeps track of the request budget of an account for each endpoint family, so that callers can
+    wait for a slot instead of running into rate limit errors.
+
+    Requests with :attr:`RequestPriority.BACKFILL` priority can't use the last
+    :attr:`backfill_reserve` fraction of a budget, which leaves room for live requests in the same
+    endpoint family. Families have separate budgets, so the reserve doesn't protect e.g. polling
+    (the ``poll`` family) from conversation history backfilling (the ``conversation`` family).
+    """
+
+    backfill_reserve: float = 0.25
+
+    buckets: dict[str, RateLimitBucket]
+
+    def __init__(self) -> None:
+        self.buckets = {}
+
+    def bucket(self, family: str) -> RateLimitBucket:
+        try:
+            return self.buckets[family]
+        except KeyError:
+            bucket = self.buckets[family] = RateLimitBucket()
+            return bucket
+
+    async def acquire(self, family: str, priority: RequestPriority = RequestPriority.LIVE) -> None:
+        """
+        Wait until there's budget left for a request.
+
+        Args:
+            family: The endpoint family that the request is for.
+            priority: The priority of the request.
+        """
+        await self.bucket(family).acquire(priority, self.backfill_reserve)
+
+    def update(self, family: str, headers: CIMultiDictProxy[str]) -> None:
+        """
+        Update the budget of an endpoint family from response headers.
+
+        Args:
+            family: The endpoint family that the request was for.
+            headers: The response headers.
+        """
+        self.bucket(family).update(headers)
+
+    async def check(self, family: str, resp: ClientResponse) -> Any:
+        """
+        Update the budget of an endpoint family from a response and check it for errors.
+        If the request was rate limited, the budget is marked as empty until the limit resets.
+
+        Args:
+            family: The endpoint family that the request was for.
+            resp: The response.
+
+        Returns:
+            The response data, as returned by :func:`check_error`.
+        """
+        self.update(family, resp.headers)
+        try:
+            return await check_error(resp)
+        except RateLimitError as e:
+            self.bucket(family).exhaust(e.reset)
+            raise
@@ -0,0 +1,186 @@
+# Copyright (c) 2022 Tulir Asokan
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from typing import Any, AsyncIterator
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+
+
+class PollScheduler:
+    """
+    A shared timer for polling many :class:`TwitterPoller` instances.
+
+    Instead of every account sleeping on its own timer, pollers ask the scheduler for a
+    :meth:`turn` after their desired delay. The scheduler keeps a single heap keyed by the time
+    each turn is due, hands out turns with a bounded number of polls in flight, and applies jitter
+    to the delays so that accounts don't end up polling in lockstep.
+    """
+
+    log: logging.Logger
+    max_concurrent: int
+    jitter: float
+    spacing: float
+
+    accounts: set[Any]
+    lag: float
+
+    _heap: list[tuple[float, int, asyncio.Future]]
+    _pending: dict[Any, asyncio.Future]
+    _counter: itertools.count
+    _semaphore: asyncio.Semaphore | None
+    _wakeup: asyncio.Event | None
+    _task: asyncio.Task | None
+
+    def __init__(
+        self,
+        max_concurrent: int = 32,
+        jitter: float = 0.1,
+        spacing: float = 0,
+        log: logging.Logger | None = None,
+    ) -> None:
+        """
+        Args:
+            max_concurrent: The maximum number of polls that may be in progress at once.
+            jitter: The maximum random variation applied to poll delays, as a fraction of the
+                delay (e.g. 0.1 means ±10%).
+            spacing: The minimum number of seconds between two polls being started.
+            log: The logger to use.
+        """
+        self.log = log or logging.getLogger("mautwitdm.scheduler")
+        self.max_concurrent = max_concurrent
+        self.jitter = jitter
+        self.spacing = spacing
+        self.accounts = set()
+        self.lag = 0
+        self._heap = []
+        self._pending = {}
+        self._counter = itertools.count()
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def queued(self) -> int:
+        """The number of pollers currently waiting for a turn."""
+        return len(self._heap)
+
+    def register(self, poller: Any) -> None:
+        """
+        Register a poller with the scheduler. This starts the scheduler task if it isn't running.
+
+        Args:
+            poller: The poller that will start requesting turns.
+        """
+        self.accounts.add(poller)
+        if self._task is None or self._task.done():
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, poller: Any) -> None:
+        """
+        Unregister a poller. Any pending turn of the poller is dropped when its poll task is
+        cancelled, so this only needs to update bookkeeping.
+
+        Args:
+            poller: The poller to remove.
+        """
+        self.accounts.discard(poller)
+        if not self.accounts and self._task:
+            self.log.debug("No pollers left, stopping scheduler task")
+            self._task.cancel()
+            self._task = None
+            self._heap = []
+            self._pending = {}
+
+    def _jittered(self, delay: float) -> float:
+        if delay <= 0 or self.jitter <= 0:
+            return max(delay, 0)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _push(self, due: float, fut: asyncio.Future) -> None:
+        heapq.heappush(self._heap, (due, next(self._counter), fut))
+        if self._heap[0][2] is fut:
+            self._wakeup.set()
+
+    def expedite(self, poller: Any) -> None:
+        """
+        Make the pending turn of a poller due immediately, e.g. when there's activity in the
+        account and waiting for the normal delay would add latency.
+
+        Args:
+            poller: The poller whose turn should be expedited.
+        """
+        fut = self._pending.get(poller)
+        if fut is not None and not fut.done():
+            # The old heap entry is left in place and skipped once the future is resolved
+            self._push(asyncio.get_running_loop().time(), fut)
+
+    @asynccontextmanager
+    async def turn(self, poller: Any, delay: float) -> AsyncIterator[None]:
+        """
+        Wait until ``delay`` seconds (with jitter) have passed and a concurrency slot is free.
+        The slot is held until the context manager exits.
+
+        Args:
+            poller: The poller requesting the turn.
+            delay: The number of seconds to wait before the turn is due.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore
+        fut = loop.create_future()
+        self._pending[poller] = fut
+        self._push(loop.time() + self._jittered(delay), fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            # The scheduler may have handed us a slot right before we were cancelled
+            if fut.done() and not fut.cancelled():
+                semaphore.release()
+            raise
+        finally:
+            if self._pending.get(poller) is fut:
+                del self._pending[poller]
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, fut = self._heap[0]
+            if fut.done():
+                heapq.heappop(self._heap)
+                continue
+            now = loop.time()
+            if due > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._semaphore.acquire()
+            # The head may have changed while waiting for the semaphore, but anything at the
+            # head now is at least as due as the entry we looked at.
+            due, _, fut = heapq.heappop(self._heap)
+            if fut.done():
+                self._semaphore.release()
+                continue
+            self.lag = loop.time() - due
+            fut.set_result(None)
+            if self.spacing > 0:
+                await asyncio.sleep(self.spacing)
@@ -0,0 +1,103 @@
+# Copyright (c) 2022 Tulir Asokan
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+from __future__ import annotations
+
+from attr import dataclass
+
+
+@dataclass
+class ServerSentEvent:
+    data: bytes
+    event: str = "message"
+    id: str | None = None
+
+
+class SSEParser:
+    """
+    An incremental parser for ``text/event-stream`` responses.
+
+    Chunks are appended to a single buffer and split into lines in place, so any number of events
+    in a chunk (and events split across any number of chunks) are handled without re-copying
+    previously received data.
+    """
+
+    last_event_id: str | None
+    retry: int | None
+
+    _buffer: bytearray
+    _data: list[bytes]
+    _event: str | None
+
+    def __init__(self, last_event_id: str | None = None) -> None:
+        """
+        Args:
+            last_event_id: The ID of the last event that was received in a previous stream.
+        """
+        self.last_event_id = last_event_id
+        self.retry = None
+        self._buffer = bytearray()
+        self._data = []
+        self._event = None
+
+    def feed(self, chunk: bytes) -> list[ServerSentEvent]:
+        """
+        Feed a chunk of the response body to the parser.
+
+        Args:
+            chunk: The bytes received from the server.
+
+        Returns:
+            The events that were completed by this chunk.
+        """
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        with memoryview(buffer) as view:
+            while True:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+                event = self._process_line(view[start:line_end])
+                if event:
+                    events.append(event)
+                start = end + 1
+        if start:
+            # Deleting from the front of a bytearray doesn't move the remaining data
+            del buffer[:start]
+        return events
+
+    def _process_line(self, line: memoryview) -> ServerSentEvent | None:
+        with line:
+            if not line:
+                return self._dispatch()
+            elif line[0] == 0x3A:  # ":", comment
+                return None
+            line = bytes(line)
+        field, sep, value = line.partition(b":")
+        if sep and value.startswith(b" "):
+            value = value[1:]
+        if field == b"data":
+            self._data.append(value)
+        elif field == b"event":
+            self._event = value.decode("utf-8")
+        elif field == b"id":
+            if b"\0" not in value:
+                self.last_event_id = value.decode("utf-8") or None
+        elif field == b"retry":
+            if value.isdigit():
+                self.retry = int(value)
+        return None
+
+    def _dispatch(self) -> ServerSentEvent | None:
+        data, self._data = self._data, []
+        event, self._event = self._event, None
+        if not data:
+            return None
+        return ServerSentEvent(
+            data=b"\n".join(data), event=event or "message", id=self.last_event_id
+        )
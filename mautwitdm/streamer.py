@@ -5,17 +5,17 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable
 import asyncio
-import io
-import json
 import logging
 
 from aiohttp import ClientSession
 from yarl import URL
 
+from . import codec
 from .dispatcher import TwitterDispatcher
 from .errors import check_error
+from .sse import SSEParser
 from .types import StreamEvent
 
 
@@ -35,6 +35,9 @@ class TwitterStreamer(TwitterDispatcher):
     user_agent: str
 
     topics: set[str]
+    stream_retry: float = 10
+    stream_last_event_id: str | None = None
+    note_activity: Callable[[], None]
     _stream_task: asyncio.Task
 
     async def _stream(self) -> AsyncGenerator[StreamEvent, None]:
@@ -48,30 +51,18 @@ class TwitterStreamer(TwitterDispatcher):
             "Referer": "https://twitter.com/messages",
             "Pragma": "no-cache",
         }
-        empty_bytes = b""
-        data_prefix = b"data: "
-        chunk_separator = b"\n\n"
-        empty_chunk = b":\n\n"
+        if self.stream_last_event_id:
+            headers["Last-Event-ID"] = self.stream_last_event_id
+        parser = SSEParser(last_event_id=self.stream_last_event_id)
         async with self.http.get(url, headers=headers) as resp:
-            buffer = io.BytesIO()
-            partial = False
-            while True:
-                chunk, end = await resp.content.readchunk()
-                if not end and chunk == empty_bytes:
-                    break
-                if not chunk.endswith(chunk_separator):
-                    buffer.write(chunk)
-                    partial = True
-                    continue
-                if partial:
-                    chunk = buffer.getvalue() + chunk
-                    buffer = io.BytesIO()
-                    partial = False
-                if chunk == empty_chunk:
-                    continue
-                elif chunk.startswith(data_prefix):
-                    data = json.loads(chunk[len(data_prefix) : -len(chunk_separator)])
+            async for chunk in resp.content.iter_any():
+                for event in parser.feed(chunk):
+                    if event.id is not None:
+                        self.stream_last_event_id = event.id
+                    data = codec.loads(event.data)
                     yield StreamEvent.deserialize(data["payload"])
+                if parser.retry is not None:
+                    self.stream_retry = parser.retry / 1000
 
     async def update_topics(self, subscribe: set[str], unsubscribe: set[str]) -> None:
         """
@@ -92,8 +83,7 @@ class TwitterStreamer(TwitterDispatcher):
         async with self.http.post(url, data=req, headers=self.headers) as resp:
             resp_data = await check_error(resp)
         event = StreamEvent.deserialize(resp_data)
-        for event_type in event.all_types:
-            await self.dispatch(event_type)
+        await self.dispatch_many(event.all_types)
 
     async def stream_forever(self, raise_exceptions: bool = True) -> None:
         """
@@ -105,14 +95,20 @@ class TwitterStreamer(TwitterDispatcher):
 
         Args:
             raise_exceptions: Whether or not errors should be raised after logging. If set to
-                ``False``, errors will be logged, and the stream will retry in 10 seconds.
+                ``False``, errors will be logged, and the stream will retry after
+                :attr:`stream_retry` seconds (10 unless the server asks for something else).
+                The retried stream resumes from the last received event ID.
                 :class:`asyncio.CancelledError` will not be raised and will simply return.
         """
         while True:
             try:
                 async for event in self._stream():
-                    for event_type in event.all_types:
-                        await self.dispatch(event_type)
+                    events = event.all_types
+                    # Typing and DM update events mean the poller should speed up, config and
+                    # subscription keepalives don't carry either and shouldn't keep it active.
+                    if events:
+                        self.note_activity()
+                        await self.dispatch_many(events)
             except asyncio.CancelledError:
                 self.log.debug("Streaming stopped")
                 break
@@ -120,7 +116,7 @@ class TwitterStreamer(TwitterDispatcher):
                 self.log.exception("Error while streaming events")
                 if raise_exceptions:
                     raise
-                await asyncio.sleep(10)
+                await asyncio.sleep(self.stream_retry)
 
     def start_streaming(self) -> asyncio.Task:
         """
@@ -5,8 +5,9 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
-from typing import Any, NamedTuple
+from typing import Any, AsyncIterable, AsyncIterator, NamedTuple, Optional
 from collections import defaultdict
+from contextlib import asynccontextmanager
 from http.cookies import SimpleCookie
 from uuid import UUID, getnode, uuid1
 import asyncio
@@ -15,15 +16,20 @@ import logging
 from aiohttp import ClientSession
 from yarl import URL
 
-from . import conversation as c
+from . import codec, conversation as c
 from .errors import TwitterError, check_error
 from .poller import TwitterPoller
+from .processing import ProcessingTracker
+from .ratelimit import RateLimitBudget
 from .streamer import TwitterStreamer
 from .types import User
 from .uploader import TwitterUploader
 
 Tokens = NamedTuple("Tokens", auth_token=str, csrf_token=str)
 DownloadResp = NamedTuple("DownloadResp", data=bytes, mime_type=str)
+DownloadStream = NamedTuple(
+    "DownloadStream", data=AsyncIterable[bytes], mime_type=str, size=Optional[int]
+)
 
 twitter_com = URL("https://twitter.com/")
 
@@ -50,13 +56,21 @@ class TwitterAPI(TwitterUploader, TwitterStreamer, TwitterPoller):
         node_id: int | None = None,
     ) -> None:
         self.loop = loop or asyncio.get_event_loop()
-        self.http = http or ClientSession(loop=self.loop)
+        self.http = http or ClientSession(loop=self.loop, json_serialize=codec.dumps)
         self.log = log or logging.getLogger("mautwitdm")
         self.node_id = node_id or getnode()
         self.poll_cursor = None
+        self.poll_interval = self.poll_sleep
+        self._last_activity = 0
+        self.rate_limits = RateLimitBudget()
+        self._processing = ProcessingTracker(self._check_processing, self.log)
         self._poll_task = None
         self.dispatch_initial_resp = False
         self._handlers = defaultdict(lambda: [])
+        self._handler_cache = {}
+        self._dispatch_semaphore = asyncio.Semaphore(self.max_concurrent_dispatch)
+        self._dispatch_queues = {}
+        self._dispatch_workers = {}
         self.active = True
         self._typing_in = None
         self.user_agent = (
@@ -90,6 +104,8 @@ class TwitterAPI(TwitterUploader, TwitterStreamer, TwitterPoller):
             conversation_id: The conversation where the user is typing, or ``None`` to stop typing.
         """
         self._typing_in = self.conversation(conversation_id)
+        if conversation_id:
+            self.note_activity()
 
     @property
     def tokens(self) -> Tokens | None:
@@ -126,17 +142,47 @@ class TwitterAPI(TwitterUploader, TwitterStreamer, TwitterPoller):
             "x-csrf-token": csrf_token,
         }
 
-    async def download_media(self, url: str) -> DownloadResp:
-        headers = {
+    @property
+    def _media_headers(self) -> dict[str, str]:
+        return {
             "Accept": "*/*",
             "DNT": "1",
             "Referer": "https://twitter.com/messages",
             "User-Agent": self.user_agent,
         }
-        async with self.http.get(url, headers=headers) as resp:
+
+    async def download_media(self, url: str) -> DownloadResp:
+        async with self.http.get(url, headers=self._media_headers) as resp:
             await check_error(resp)
             return DownloadResp(data=await resp.read(), mime_type=resp.headers["Content-Type"])
 
+    @asynccontextmanager
+    async def stream_media(
+        self, url: str, chunk_size: int = 64 * 1024
+    ) -> AsyncIterator[DownloadStream]:
+        """
+        Download media without reading the whole file into memory. The response body can be read
+        in chunks from the ``data`` field of the yielded value until the context manager exits.
+
+        Args:
+            url: The URL to download.
+            chunk_size: The maximum size of chunks to yield.
+
+        Returns:
+            An async context manager that yields the response body iterator, the MIME type and
+            the size from the ``Content-Length`` header (if the server sent one).
+        """
+        async with self.http.get(url, headers=self._media_headers) as resp:
+            if resp.content_type == "application/json":
+                # Error responses are JSON, but check_error would read successful bodies too
+                await check_error(resp)
+            resp.raise_for_status()
+            yield DownloadStream(
+                data=resp.content.iter_chunked(chunk_size),
+                mime_type=resp.headers["Content-Type"],
+                size=resp.content_length,
+            )
+
     def new_request_id(self) -> UUID:
         """
         Create a new request ID for DM send requests.
@@ -193,6 +239,7 @@ class TwitterAPI(TwitterUploader, TwitterStreamer, TwitterPoller):
         if usernames:
             query["screen_name"] = ",".join(usernames)
         req = (self.base_url / "users" / "lookup.json").with_query(query)
+        await self.rate_limits.acquire("users")
         async with self.http.get(req, headers=self.headers) as resp:
-            resp_data = await check_error(resp)
+            resp_data = await self.rate_limits.check("users", resp)
             return [User.deserialize(user) for user in resp_data]
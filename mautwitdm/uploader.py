@@ -5,60 +5,164 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 from __future__ import annotations
 
+from typing import Any, AsyncGenerator, AsyncIterable, Callable, Union
 import asyncio
 import logging
-import math
+import time
 
-from aiohttp import ClientSession, MultipartWriter
+from aiohttp import (
+    ClientConnectionError,
+    ClientPayloadError,
+    ClientResponseError,
+    ClientSession,
+    MultipartWriter,
+)
 from yarl import URL
 
 from .errors import UnsupportedAttachmentError, check_error
+from .processing import ProcessingTracker
+from .ratelimit import RateLimitBudget
 from .types import MediaUploadResponse
 
+Segment = Union[memoryview, bytearray]
+
 
 class TwitterUploader:
     upload_url: URL = URL("https://upload.twitter.com/i/media/upload.json")
+    # Number of APPEND requests that are sent concurrently
+    upload_concurrency: int = 4
+    # The segment size is adjusted based on the measured upload speed, so that each segment
+    # takes about segment_target_secs to upload. Twitter allows segments up to 5 MiB.
+    min_segment_size: int = 2**17
+    max_segment_size: int = 4 * 1024 * 1024
+    segment_target_secs: float = 2
+    # Number of times a failed segment is retried before the whole upload fails
+    segment_retries: int = 3
+    # Maximum number of seconds to wait for Twitter to process uploaded media
+    processing_timeout: float = 300
 
     http: ClientSession
     log: logging.Logger
     headers: dict[str, str]
+    rate_limits: RateLimitBudget
+    _processing: ProcessingTracker
 
-    async def _wait_processing(self, media_id: str, wait_requests: int = 1) -> MediaUploadResponse:
+    async def _check_processing(self, media_id: str) -> dict[str, Any]:
         query_req = self.upload_url.with_query({"command": "STATUS", "media_id": media_id})
-        while True:
-            await asyncio.sleep(wait_requests)
-            async with self.http.get(query_req, headers=self.headers) as resp:
-                data = await check_error(resp)
-            state = data["processing_info"]["state"]
-            if state == "succeeded":
-                self.log.debug(f"Server completed processing of {media_id}")
-                return MediaUploadResponse.deserialize(data)
-            elif state == "in_progress":
-                progress = data["processing_info"]["progress_percent"]
-                wait_requests = data["processing_info"].get("check_after_secs", wait_requests)
-                self.log.debug(
-                    f"Upload of {media_id} at {progress} %, "
-                    f"re-checking after {wait_requests} seconds"
-                )
-            else:
-                raise RuntimeError(f"Unknown state {state}")
+        await self.rate_limits.acquire("media_status")
+        async with self.http.get(query_req, headers=self.headers) as resp:
+            return await self.rate_limits.check("media_status", resp)
 
-    async def _upload_data(self, media_id: str, data: bytes) -> MediaUploadResponse:
-        max_size = 2**17
-        base_upload_req = self.upload_url.with_query(
-            {
-                "command": "APPEND",
-                "media_id": media_id,
-            }
+    def stop_processing_checks(self) -> None:
+        """Stop waiting for Twitter to process uploads. Any ongoing waits are cancelled."""
+        self._processing.stop()
+
+    async def _wait_processing(self, media_id: str, wait_requests: int = 1) -> MediaUploadResponse:
+        return await self._processing.wait(
+            media_id, check_after=wait_requests, timeout=self.processing_timeout
+        )
+
+    async def _append_segment(self, media_id: str, index: int, segment: Segment) -> float:
+        req = self.upload_url.with_query(
+            {"command": "APPEND", "media_id": media_id, "segment_index": index}
         )
-        for i in range(math.ceil(len(data) / max_size)):
+        attempt = 0
+        while True:
             multipart_data = MultipartWriter("form-data")
-            part = multipart_data.append(data[i * max_size : (i + 1) * max_size])
+            part = multipart_data.append(segment)
             part.set_content_disposition("form-data", name="media", filename="blob")
-            req = base_upload_req.update_query({"segment_index": i})
-            async with self.http.post(req, data=multipart_data, headers=self.headers) as resp:
-                await check_error(resp)
-                self.log.debug(f"Uploaded segment {i} of {media_id}")
+            start = time.monotonic()
+            try:
+                async with self.http.post(req, data=multipart_data, headers=self.headers) as resp:
+                    await check_error(resp)
+            except (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError) as e:
+                error = e
+            except ClientResponseError as e:
+                if e.status < 500:
+                    raise
+                error = e
+            else:
+                return time.monotonic() - start
+            if attempt >= self.segment_retries:
+                raise error
+            attempt += 1
+            wait = 2**attempt
+            self.log.warning(
+                f"Failed to upload segment {index} of {media_id} ({error!r}), "
+                f"retrying in {wait} seconds (attempt {attempt}/{self.segment_retries})"
+            )
+            await asyncio.sleep(wait)
+
+    @staticmethod
+    async def _iter_segments(
+        data: bytes | AsyncIterable[bytes], get_size: Callable[[], int]
+    ) -> AsyncGenerator[Segment, None]:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            # Slicing a memoryview doesn't copy the data
+            view = memoryview(data)
+            offset = 0
+            while offset < len(view):
+                size = get_size()
+                yield view[offset : offset + size]
+                offset += size
+            return
+        # Streamed segments are at least the current segment size. A new buffer is started for
+        # each segment instead of cutting the old one, so segments never have to be copied.
+        buffer = bytearray()
+        async for chunk in data:
+            buffer += chunk
+            if len(buffer) >= get_size():
+                yield buffer
+                buffer = bytearray()
+        if buffer:
+            yield buffer
+
+    async def _upload_data(
+        self, media_id: str, data: bytes | AsyncIterable[bytes], size: int
+    ) -> MediaUploadResponse:
+        segment_size = self.min_segment_size
+        slots = asyncio.Semaphore(self.upload_concurrency)
+        tasks: set[asyncio.Task] = set()
+        index = 0
+        uploaded = 0
+
+        async def append(index: int, segment: Segment) -> None:
+            nonlocal segment_size
+            try:
+                duration = await self._append_segment(media_id, index, segment)
+            finally:
+                slots.release()
+            # Aim for segments that take segment_target_secs to upload at the measured speed
+            throughput = len(segment) / max(duration, 0.001)
+            segment_size = min(
+                max(int(throughput * self.segment_target_secs), self.min_segment_size),
+                self.max_segment_size,
+            )
+            self.log.debug(
+                f"Uploaded segment {index} of {media_id} ({len(segment)} bytes in "
+                f"{duration:.2f} seconds, next segment size {segment_size})"
+            )
+
+        try:
+            async for segment in self._iter_segments(data, lambda: segment_size):
+                # Wait for a free slot before reading more of a stream, so at most
+                # upload_concurrency segments are held in memory.
+                await slots.acquire()
+                for task in [task for task in tasks if task.done()]:
+                    tasks.remove(task)
+                    # Stop early if a segment failed even after retrying
+                    task.result()
+                tasks.add(asyncio.create_task(append(index, segment)))
+                uploaded += len(segment)
+                index += 1
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        if uploaded != size:
+            raise ValueError(f"Upload of {media_id} was {uploaded} bytes, expected {size}")
+
         finalize_req = self.upload_url.with_query(
             {
                 "command": "FINALIZE",
@@ -72,12 +176,30 @@ class TwitterUploader:
             self.log.debug(f"Finished uploading {media_id}, but server is still processing it")
             check_after = processing_info.get("check_after_secs", 1)
             return await self._wait_processing(media_id, check_after)
-        self.log.debug(f"Finished uploading {media_id}")
+        self.log.debug(f"Finished uploading {media_id} in {index} segments")
         return MediaUploadResponse.deserialize(resp_data)
 
     async def upload(
-        self, data: bytes = None, url: str = None, mime_type: str = None, is_audio: bool = False
+        self,
+        data: bytes | AsyncIterable[bytes] | None = None,
+        url: str | None = None,
+        mime_type: str | None = None,
+        is_audio: bool = False,
+        size: int | None = None,
     ) -> MediaUploadResponse:
+        """
+        Upload media to Twitter.
+
+        Args:
+            data: The file to upload, either as bytes or as an async iterable of chunks.
+            url: The URL to have Twitter fetch the media from, if ``data`` isn't provided.
+            mime_type: The mime type of the media.
+            is_audio: Whether the video should be sent as a voice message.
+            size: The size of the file. Required when ``data`` is an async iterable.
+
+        Returns:
+            The upload response, including the media ID to send.
+        """
         if mime_type == "image/gif":
             category = "dm_gif"
             size_limit = 15 * 1024 * 1024
@@ -91,7 +213,11 @@ class TwitterUploader:
             size_limit = 15 * 1024 * 1024
         else:
             raise UnsupportedAttachmentError(f"Unsupported mime type {mime_type}")
-        if len(data) > size_limit:
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            size = len(data)
+        elif data is not None and size is None:
+            raise ValueError("size must be provided when uploading a stream")
+        if size is not None and size > size_limit:
             raise UnsupportedAttachmentError("File too big")
         init_req = {
             "command": "INIT",
@@ -99,7 +225,7 @@ class TwitterUploader:
             "media_category": category,
         }
         if data is not None:
-            init_req["total_bytes"] = len(data)
+            init_req["total_bytes"] = size
         elif url is not None:
             init_req["source_url"] = url
         else:
@@ -113,9 +239,9 @@ class TwitterUploader:
         if url is not None:
             processing_info = resp_data.get("processing_info", {})
             if processing_info.get("state") == "succeeded":
-                return MediaUploadResponse.deserialize(data)
+                return MediaUploadResponse.deserialize(resp_data)
             else:
                 check_after = processing_info.get("check_after_secs", 1)
                 return await self._wait_processing(media_id, check_after)
         else:
-            return await self._upload_data(media_id, data)
+            return await self._upload_data(media_id, data, size)
@@ -0,0 +1,163 @@
+"""
+Benchmark the JSON libraries that :mod:`mautwitdm.codec` can use.
+
+Usage: ``python tests/bench_codec.py [fixture.json ...]``
+
+Pass recorded ``inbox_initial_state`` and ``user_updates`` response bodies to benchmark real
+payloads. Recorded responses contain private messages, so they aren't included in the repo. If no
+fixtures are given, synthetic payloads with the same structure are generated instead.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable
+import importlib
+import json
+import random
+import sys
+import timeit
+
+
+def _user(rng: random.Random, user_id: int) -> dict[str, Any]:
+    return {
+        "id": user_id,
+        "id_str": str(user_id),
+        "name": f"User {user_id}",
+        "screen_name": f"user_{user_id}",
+        "profile_image_url": f"http://pbs.twimg.com/profile_images/{user_id}/avatar_normal.jpg",
+        "profile_image_url_https": (
+            f"https://pbs.twimg.com/profile_images/{user_id}/avatar_normal.jpg"
+        ),
+        "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 2,
+        "created_at": "Tue Mar 21 20:50:14 +0000 2006",
+        "verified": rng.random() < 0.1,
+        "protected": rng.random() < 0.2,
+        "can_media_tag": True,
+        "following": rng.random() < 0.5,
+        "follow_request_sent": False,
+        "friends_count": rng.randint(0, 5000),
+        "followers_count": rng.randint(0, 50000),
+        "statuses_count": rng.randint(0, 100000),
+        "location": "Somewhere",
+        "url": None,
+    }
+
+
+def _message(rng: random.Random, msg_id: int, conv_id: str, sender: int) -> dict[str, Any]:
+    time = str(1650000000000 + msg_id)
+    return {
+        "message": {
+            "id": str(msg_id),
+            "time": time,
+            "affects_sort": True,
+            "request_id": f"{msg_id:032x}",
+            "conversation_id": conv_id,
+            "message_data": {
+                "id": str(msg_id),
+                "time": time,
+                "sender_id": str(sender),
+                "conversation_id": conv_id,
+                "text": " ".join(
+                    rng.choice(["hello", "world", "🐦", "ok", "😀"]) for _ in range(20)
+                ),
+                "entities": {"hashtags": [], "symbols": [], "user_mentions": [], "urls": []},
+            },
+        }
+    }
+
+
+def _conversation(conv_id: str, participants: list[int]) -> dict[str, Any]:
+    return {
+        "conversation_id": conv_id,
+        "type": "GROUP_DM" if len(participants) > 2 else "ONE_TO_ONE",
+        "sort_event_id": "1500000000000000000",
+        "sort_timestamp": "1650000000000",
+        "participants": [
+            {"user_id": str(user_id), "last_read_event_id": "1500000000000000000"}
+            for user_id in participants
+        ],
+        "nsfw": False,
+        "notifications_disabled": False,
+        "mention_notifications_disabled": False,
+        "read_only": False,
+        "trusted": True,
+        "muted": False,
+        "status": "HAS_MORE",
+        "min_entry_id": "1400000000000000000",
+        "max_entry_id": "1500000000000000000",
+    }
+
+
+def _events(rng: random.Random, conversations: int, messages: int) -> dict[str, Any]:
+    users = {}
+    convs = {}
+    for _ in range(conversations):
+        participants = [1000] + [rng.randint(2000, 9999) for _ in range(rng.randint(1, 5))]
+        conv_id = "-".join(str(user_id) for user_id in participants[:2])
+        convs[conv_id] = _conversation(conv_id, participants)
+        for user_id in participants:
+            users[str(user_id)] = _user(rng, user_id)
+    conv_ids = list(convs)
+    entries = [
+        _message(rng, 1500000000000000000 + i, conv_id, int(conv_id.split("-")[1]))
+        for i, conv_id in enumerate(rng.choice(conv_ids) for _ in range(messages))
+    ]
+    return {
+        "min_entry_id": "1400000000000000000",
+        "max_entry_id": "1500000000000000000",
+        "cursor": "GRwmgIC9oe3Z8LgqFoCAvaHt2fC4KiUAAA",
+        "last_seen_event_id": "1500000000000000000",
+        "entries": entries,
+        "users": users,
+        "conversations": convs,
+    }
+
+
+def synthetic_fixtures() -> dict[str, bytes]:
+    rng = random.Random(0)
+    return {
+        "inbox_initial_state": json.dumps(
+            {"inbox_initial_state": _events(rng, conversations=50, messages=500)}
+        ).encode("utf-8"),
+        "user_updates": json.dumps(
+            {"user_events": _events(rng, conversations=5, messages=20)}
+        ).encode("utf-8"),
+    }
+
+
+def backends() -> dict[str, tuple[Callable[[bytes], Any], Callable[[Any], Any]]]:
+    found = {"json": (json.loads, json.dumps)}
+    for name in ("ujson", "orjson"):
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        found[name] = (module.loads, module.dumps)
+    return found
+
+
+def main(paths: list[str]) -> None:
+    if paths:
+        fixtures = {}
+        for path in paths:
+            with open(path, "rb") as file:
+                fixtures[path] = file.read()
+    else:
+        fixtures = synthetic_fixtures()
+    for fixture_name, data in fixtures.items():
+        print(f"{fixture_name} ({len(data) / 1024:.1f} KiB)")
+        baseline = None
+        parsed = json.loads(data)
+        for name, (loads, dumps) in backends().items():
+            number, total = timeit.Timer(lambda: loads(data)).autorange()
+            load_time = total / number
+            number, total = timeit.Timer(lambda: dumps(parsed)).autorange()
+            dump_time = total / number
+            baseline = baseline or load_time
+            print(
+                f"  {name:<8} loads {load_time * 1000:8.3f} ms ({baseline / load_time:4.1f}x)"
+                f"  dumps {dump_time * 1000:8.3f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+from collections import defaultdict
+from dataclasses import dataclass
+import asyncio
+import logging
+import random
+
+from mautwitdm.dispatcher import TwitterDispatcher
+
+
+@dataclass
+class Event:
+    key: str
+    seq: int
+
+
+class Dispatcher(TwitterDispatcher):
+    def __init__(self, max_concurrent: int = 8) -> None:
+        self.log = logging.getLogger("test")
+        self._handlers = defaultdict(lambda: [])
+        self._handler_cache = {}
+        self._dispatch_semaphore = asyncio.Semaphore(max_concurrent)
+        self._dispatch_queues = {}
+        self._dispatch_workers = {}
+
+
+async def wait_idle(dispatcher: Dispatcher) -> None:
+    await asyncio.gather(*(queue.join() for queue in list(dispatcher._dispatch_queues.values())))
+
+
+def test_same_key_is_handled_in_order_with_slow_handlers() -> None:
+    async def run() -> None:
+        dispatcher = Dispatcher(max_concurrent=4)
+        rng = random.Random(1234)
+        handled = defaultdict(list)
+        running = set()
+        max_running = 0
+
+        async def handler(evt: Event) -> None:
+            nonlocal max_running
+            assert evt.key not in running, "two events of the same key were handled at once"
+            running.add(evt.key)
+            max_running = max(max_running, len(running))
+            # Earlier events sleep longer on average, so a broken implementation that handles
+            # events of one key concurrently would finish them out of order.
+            await asyncio.sleep(rng.random() * 0.01 / (evt.seq + 1))
+            handled[evt.key].append(evt.seq)
+            running.discard(evt.key)
+
+        dispatcher.add_handler(Event, handler)
+        keys = [f"conv{i}" for i in range(6)]
+        sent = defaultdict(list)
+        for _ in range(120):
+            key = rng.choice(keys)
+            seq = len(sent[key])
+            sent[key].append(seq)
+            await dispatcher.dispatch_ordered(key, Event(key, seq))
+        await wait_idle(dispatcher)
+        dispatcher.stop_dispatching()
+
+        assert dict(handled) == dict(sent)
+        assert 1 < max_running <= 4
+
+    asyncio.run(run())
+
+
+def test_slow_key_does_not_block_other_keys() -> None:
+    async def run() -> None:
+        dispatcher = Dispatcher()
+        slow_started = asyncio.Event()
+        release_slow = asyncio.Event()
+        order = []
+
+        async def handler(evt: Event) -> None:
+            if evt.key == "slow" and evt.seq == 0:
+                slow_started.set()
+                await release_slow.wait()
+            order.append((evt.key, evt.seq))
+
+        dispatcher.add_handler(Event, handler)
+        await dispatcher.dispatch_ordered("slow", Event("slow", 0))
+        await dispatcher.dispatch_ordered("slow", Event("slow", 1))
+        await slow_started.wait()
+        for seq in range(3):
+            await dispatcher.dispatch_ordered("fast", Event("fast", seq))
+        await dispatcher._dispatch_queues["fast"].join()
+        assert order == [("fast", 0), ("fast", 1), ("fast", 2)]
+
+        release_slow.set()
+        await wait_idle(dispatcher)
+        dispatcher.stop_dispatching()
+        assert order[3:] == [("slow", 0), ("slow", 1)]
+
+    asyncio.run(run())
+
+
+def test_global_semaphore_limits_concurrency() -> None:
+    async def run() -> None:
+        dispatcher = Dispatcher()
+        dispatcher.global_dispatch_semaphore = asyncio.Semaphore(2)
+        running = 0
+        max_running = 0
+
+        async def handler(evt: Event) -> None:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        dispatcher.add_handler(Event, handler)
+        for seq in range(5):
+            for key in ("a", "b", "c", "d"):
+                await dispatcher.dispatch_ordered(key, Event(key, seq))
+        await wait_idle(dispatcher)
+        dispatcher.stop_dispatching()
+        assert max_running == 2
+
+    asyncio.run(run())
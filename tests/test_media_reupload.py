@@ -0,0 +1,118 @@
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+import asyncio
+import logging
+
+from aiohttp import ClientConnectionError
+import pytest
+
+# The bridge modules import each other, load them in the same order as the bridge does
+import mautrix_twitter.backfill  # noqa: F401
+from mautrix_twitter.portal import Portal
+from mautwitdm.twitter import DownloadStream
+
+
+class FakeTwitter:
+    def __init__(self) -> None:
+        self.opened = 0
+        self.closed = 0
+
+    @asynccontextmanager
+    async def stream_media(self, url: str):
+        self.opened += 1
+
+        async def data():
+            yield b"a" * 10
+            yield b"b" * 10
+
+        try:
+            yield DownloadStream(data=data(), mime_type="image/png", size=20)
+        finally:
+            self.closed += 1
+
+
+class FakeIntent:
+    def __init__(self, fail_create: bool = False, upload_errors: list | None = None) -> None:
+        self.fail_create = fail_create
+        self.upload_errors = upload_errors or []
+        self.uploaded = []
+
+    async def create_mxc(self):
+        if self.fail_create:
+            raise RuntimeError("create_mxc failed")
+        return SimpleNamespace(content_uri="mxc://example.com/async")
+
+    async def upload_media(self, data, mime_type=None, filename=None, size=None, mxc=None):
+        if self.upload_errors:
+            raise self.upload_errors.pop(0)
+        self.uploaded.append(b"".join([chunk async for chunk in data]))
+        return mxc or "mxc://example.com/sync"
+
+
+def make_portal(async_media: bool) -> Portal:
+    portal = Portal.__new__(Portal)
+    portal.config = {"bridge.media_cache.enabled": False, "homeserver.async_media": async_media}
+    portal.encrypted = False
+    portal.mxid = "!room:example.com"
+    portal.log = logging.getLogger("test")
+    portal.media_semaphore = asyncio.Semaphore(2)
+    return portal
+
+
+async def reupload(portal: Portal, twitter: FakeTwitter, intent: FakeIntent):
+    source = SimpleNamespace(client=twitter)
+    return await asyncio.wait_for(
+        portal._reupload_twitter_media(source, "https://ton.twitter.com/a.png", intent), 5
+    )
+
+
+@pytest.mark.parametrize(
+    "async_media,intent",
+    [
+        (False, lambda: FakeIntent(upload_errors=[RuntimeError("upload failed")])),
+        (True, lambda: FakeIntent(fail_create=True)),
+    ],
+)
+def test_failed_reupload_releases_slot_and_stream(async_media, intent):
+    async def run():
+        portal = make_portal(async_media)
+        twitter = FakeTwitter()
+        # More failures than there are slots, a leaked slot would make this hang
+        for _ in range(3):
+            with pytest.raises(RuntimeError):
+                await reupload(portal, twitter, intent())
+        assert portal.media_semaphore._value == 2
+        assert twitter.opened == twitter.closed == 3
+
+    asyncio.run(run())
+
+
+def test_failed_background_upload_releases_slot_and_stream():
+    async def run():
+        portal = make_portal(async_media=True)
+        twitter = FakeTwitter()
+        for _ in range(3):
+            intent = FakeIntent(upload_errors=[RuntimeError("upload failed")])
+            info = await reupload(portal, twitter, intent)
+            assert info.mxc == "mxc://example.com/async"
+            for _ in range(10):
+                await asyncio.sleep(0)
+        assert portal.media_semaphore._value == 2
+        assert twitter.opened == twitter.closed == 3
+
+    asyncio.run(run())
+
+
+def test_transient_upload_error_downloads_again():
+    async def run():
+        portal = make_portal(async_media=False)
+        twitter = FakeTwitter()
+        intent = FakeIntent(upload_errors=[ClientConnectionError()])
+        info = await reupload(portal, twitter, intent)
+        assert info.mxc == "mxc://example.com/sync"
+        assert info.size == 20
+        assert intent.uploaded == [b"a" * 10 + b"b" * 10]
+        assert twitter.opened == twitter.closed == 2
+        assert portal.media_semaphore._value == 2
+
+    asyncio.run(run())
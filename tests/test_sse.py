@@ -0,0 +1,80 @@
+import random
+
+from mautwitdm.sse import ServerSentEvent, SSEParser
+
+
+def build_stream(rng: random.Random, count: int) -> tuple[bytes, list[ServerSentEvent]]:
+    lines = []
+    expected = []
+    last_id = None
+    for i in range(count):
+        newline = rng.choice([b"\n", b"\r\n"])
+        if rng.random() < 0.3:
+            lines.append(b": keepalive comment" + newline)
+        event_type = rng.choice([None, "message", "dm_update"])
+        if event_type:
+            lines.append(b"event: " + event_type.encode("utf-8") + newline)
+        data = [f'{{"n": {i}, "part": {j}}}'.encode("utf-8") for j in range(rng.randint(1, 3))]
+        for part in data:
+            sep = rng.choice([b": ", b":"])
+            lines.append(b"data" + sep + part + rng.choice([b"\n", b"\r\n"]))
+            if rng.random() < 0.2:
+                lines.append(b":comment between data lines" + newline)
+        if rng.random() < 0.5:
+            last_id = f"id-{i}"
+            lines.append(b"id: " + last_id.encode("utf-8") + newline)
+        lines.append(newline)
+        expected.append(
+            ServerSentEvent(data=b"\n".join(data), event=event_type or "message", id=last_id)
+        )
+    return b"".join(lines), expected
+
+
+def feed_chunks(parser: SSEParser, stream: bytes, cuts: list[int]) -> list[ServerSentEvent]:
+    events = []
+    prev = 0
+    for cut in [*cuts, len(stream)]:
+        events += parser.feed(stream[prev:cut])
+        prev = cut
+    return events
+
+
+def test_random_fragmentation() -> None:
+    rng = random.Random(8)
+    for _ in range(50):
+        stream, expected = build_stream(rng, rng.randint(1, 20))
+        cuts = sorted(
+            rng.sample(range(1, len(stream)), k=min(len(stream) - 1, rng.randint(0, 40)))
+        )
+        assert feed_chunks(SSEParser(), stream, cuts) == expected
+
+
+def test_byte_by_byte() -> None:
+    stream, expected = build_stream(random.Random(9), 30)
+    assert feed_chunks(SSEParser(), stream, list(range(1, len(stream)))) == expected
+
+
+def test_crlf_split_between_chunks() -> None:
+    parser = SSEParser()
+    assert parser.feed(b"data: foo\r") == []
+    assert parser.feed(b"\ndata: bar\r\n\r") == []
+    assert parser.feed(b"\n") == [ServerSentEvent(data=b"foo\nbar")]
+
+
+def test_comments_and_fields_without_value() -> None:
+    parser = SSEParser()
+    events = parser.feed(b":comment\n: another\ndata\ndata:x\n\n:only a comment\n\n")
+    assert events == [ServerSentEvent(data=b"\nx")]
+
+
+def test_id_is_kept_and_reset() -> None:
+    parser = SSEParser(last_event_id="old")
+    events = parser.feed(b"data: a\n\nid: 5\ndata: b\n\ndata: c\n\nid\ndata: d\n\n")
+    assert [evt.id for evt in events] == ["old", "5", "5", None]
+    assert parser.last_event_id is None
+
+
+def test_retry() -> None:
+    parser = SSEParser()
+    assert parser.feed(b"retry: 1500\r\nretry: bad\r\n") == []
+    assert parser.retry == 1500